@@ -13,6 +13,9 @@
         # Security
         'security/security.xml',
         'security/ir.model.access.csv',
+        # Data
+        'data/config_parameter.xml',
+        'data/ir_cron.xml',
         # Wizards
         'wizards/create_menu.xml',
         # Views
@@ -28,11 +31,13 @@
         'web.assets_backend': [
             'dashboard_frame/static/src/js/smart_analytics_form_renderer.js',
             'dashboard_frame/static/src/js/smart_analytics_form_view.js',
+            'dashboard_frame/static/src/js/smart_analytics_iframe_host.js',
             'dashboard_frame/static/src/js/smart_analytics_url2iframe.js',
         ],
         'web.assets_frontend': [
             'dashboard_frame/static/src/js/smart_analytics_form_renderer.js',
             'dashboard_frame/static/src/js/smart_analytics_form_view.js',
+            'dashboard_frame/static/src/js/smart_analytics_iframe_host.js',
             'dashboard_frame/static/src/js/smart_analytics_url2iframe.js',
         ],
         'web.assets_qweb': [
@@ -1,4 +1,17 @@
-from odoo import api, fields, models, _
+import base64
+import hashlib
+import logging
+import os
+import subprocess
+import tempfile
+from collections import defaultdict
+from datetime import timedelta
+
+from odoo import api, fields, models, tools, _
+from odoo.exceptions import UserError
+from odoo.tools.misc import find_in_path
+
+_logger = logging.getLogger(__name__)
 
 
 class SmartAnalyticsDashboard(models.Model):
@@ -11,21 +24,119 @@ class SmartAnalyticsDashboard(models.Model):
     action_id = fields.Many2one('ir.actions.act_window', string='Action')
     menu_id = fields.Many2one('ir.ui.menu', string='Menu')
     group_ids = fields.Many2many('res.groups', string="Access Groups")
+    image_path = fields.Char(string='Image path',
+                             help='Path of a static image (e.g. my_module/static/img/dashboard.png) used as image '
+                                  'of the dashboard. It is only loaded again when the file changes.')
+    image_checksum = fields.Char(string='Image path checksum', readonly=True)
+    snapshot_enabled = fields.Boolean(string='Snapshot mode',
+                                      help='Display a periodically rendered snapshot of the dashboard instead of '
+                                           'the live report. Users can still open the live version.')
+    snapshot_ttl = fields.Integer(string='Snapshot lifetime (hours)', default=24)
+    snapshot = fields.Binary(string='Snapshot', attachment=True, readonly=True)
+    snapshot_date = fields.Datetime(string='Snapshot date', readonly=True)
+    show_snapshot = fields.Boolean(compute='_compute_show_snapshot')
+
+    @api.depends('snapshot_enabled', 'snapshot_date')
+    @api.depends_context('dashboard_live')
+    def _compute_show_snapshot(self):
+        live = self.env.context.get('dashboard_live')
+        for record in self:
+            record.show_snapshot = record.snapshot_enabled and bool(record.snapshot_date) and not live
+
+    @api.model
+    def get_iframe_host_config(self):
+        """ Configuration of the iframe host of the url2iframe widget: size of the pool of
+        iframes kept alive and dashboard urls to preconnect to. """
+        pool_size = self.env['ir.config_parameter'].sudo().get_param('dashboard_frame.iframe_pool_size', 4)
+        return {
+            'pool_size': int(pool_size),
+            'urls': list(set(self.search([]).mapped('url'))),
+        }
+
+    @api.model
+    def _read_image_path(self, image_path):
+        with tools.file_open(image_path, 'rb') as image_file:
+            image = image_file.read()
+        return {
+            'image_1920': base64.b64encode(image),
+            'image_checksum': hashlib.sha1(image).hexdigest(),
+        }
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if vals.get('image_path') and 'image_1920' not in vals:
+                vals.update(self._read_image_path(vals['image_path']))
+        return super().create(vals_list)
 
     def write(self, vals):
+        if vals.get('image_path') and 'image_1920' not in vals:
+            # Data packs write the same path on every upgrade: skip the resizing of unchanged images
+            image_vals = self._read_image_path(vals['image_path'])
+            outdated = self.filtered(lambda r: r.image_checksum != image_vals['image_checksum'])
+            if outdated:
+                super(SmartAnalyticsDashboard, outdated).write(image_vals)
         res = super().write(vals)
-        for record in self:
-            if record.menu_id:
-                record.menu_id.write({
-                    'groups_id': [(6, 0, record.group_ids.ids)] if record.group_ids else False,
-                })
+        if 'group_ids' in vals:
+            self._sync_menu_groups_on_commit()
         return res
 
     def unlink(self):
-        for record in self:
-            record.remove_menu()
+        self.remove_menu()
         return super().unlink()
 
+    def _sync_menu_groups_on_commit(self):
+        """ Sync the groups of the menus of the dashboards once, before the commit: a data pack writes its
+        dashboards one by one, each write of menu groups would clear the menu cache. """
+        data = self.env.cr.precommit.data
+        if 'smart_analytics_dashboard.menu_groups' not in data:
+            data['smart_analytics_dashboard.menu_groups'] = set()
+            self.env.cr.precommit.add(self._sync_pending_menu_groups)
+        data['smart_analytics_dashboard.menu_groups'].update(self.ids)
+
+    def _sync_pending_menu_groups(self):
+        dashboard_ids = self.env.cr.precommit.data.pop('smart_analytics_dashboard.menu_groups', set())
+        self.browse(dashboard_ids).exists()._sync_menu_groups()
+        self.env['ir.ui.menu'].flush()
+
+    def _sync_menu_groups(self):
+        """ Give the access groups of the dashboards to their menu, with one write per set of groups.
+        Menus already holding the right groups are not written, to keep the menu cache. """
+        menus_by_groups = defaultdict(lambda: self.env['ir.ui.menu'])
+        for record in self.filtered('menu_id'):
+            if record.menu_id.groups_id != record.group_ids:
+                menus_by_groups[record.group_ids] |= record.menu_id
+        for groups, menus in menus_by_groups.items():
+            menus.write({'groups_id': [(6, 0, groups.ids)]})
+
+    def _provision_menus(self, parent_menu, name=False):
+        """ Create the action and the menu of the dashboards without menu, under ``parent_menu``.
+        All the actions and menus are created at once, whatever the number of dashboards.
+
+        :param parent_menu: ir.ui.menu record
+        :param name: name of the menus, defaults to the name of each dashboard
+        """
+        dashboards = self.filtered(lambda d: not d.menu_id)
+        if not dashboards:
+            return
+        view = self.env.ref('dashboard_frame.smart_analytics_dashboard_iframe_form')
+        actions = self.env['ir.actions.act_window'].create([{
+            'name': name or dashboard.name,
+            'res_model': self._name,
+            'view_mode': 'form',
+            'views': [(view.id, 'form')],
+            'view_id': view.id,
+            'res_id': dashboard.id,
+        } for dashboard in dashboards])
+        menus = self.env['ir.ui.menu'].create([{
+            'name': name or dashboard.name,
+            'parent_id': parent_menu.id,
+            'groups_id': [(6, 0, dashboard.group_ids.ids)],
+            'action': 'ir.actions.act_window,%d' % (action.id,),
+        } for dashboard, action in zip(dashboards, actions)])
+        for dashboard, action, menu in zip(dashboards, actions, menus):
+            dashboard.write({'action_id': action.id, 'menu_id': menu.id})
+
     def create_menu(self):
         self.ensure_one()
         wizard = self.env['smart.analytics.dashboard.create.menu'].create({
@@ -42,8 +153,59 @@ class SmartAnalyticsDashboard(models.Model):
         }
 
     def remove_menu(self):
+        self.mapped('action_id').unlink()
+        self.mapped('menu_id').unlink()
+
+    def action_open_live(self):
         self.ensure_one()
-        if self.action_id:
-            self.action_id.unlink()
-        if self.menu_id:
-            self.menu_id.unlink()
\ No newline at end of file
+        view = self.env.ref('dashboard_frame.smart_analytics_dashboard_iframe_form')
+        return {
+            'type': 'ir.actions.act_window',
+            'name': self.name,
+            'view_mode': 'form',
+            'views': [(view.id, 'form')],
+            'res_model': self._name,
+            'res_id': self.id,
+            'context': {'dashboard_live': True},
+        }
+
+    def action_refresh_snapshot(self):
+        for record in self:
+            record.write({
+                'snapshot': base64.b64encode(record._snapshot_render()),
+                'snapshot_date': fields.Datetime.now(),
+            })
+
+    def _snapshot_render(self):
+        """ Return a PNG rendering of the dashboard url, made by a local wkhtmltoimage.
+        Override this method to use another renderer. """
+        self.ensure_one()
+        try:
+            wkhtmltoimage = find_in_path('wkhtmltoimage')
+        except IOError:
+            raise UserError(_('wkhtmltoimage must be installed to render dashboard snapshots.'))
+        delay = self.env['ir.config_parameter'].sudo().get_param('dashboard_frame.snapshot_javascript_delay', 10000)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'snapshot.png')
+            process = subprocess.run(
+                [wkhtmltoimage, '--quiet', '--format', 'png', '--width', '1920',
+                 '--javascript-delay', str(delay), self.url, output],
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=300,
+            )
+            if process.returncode or not os.path.exists(output):
+                raise UserError(_('Snapshot of the dashboard "%s" failed:\n%s') % (
+                    self.name, process.stderr.decode(errors='replace')))
+            with open(output, 'rb') as snapshot_file:
+                return snapshot_file.read()
+
+    @api.model
+    def _cron_refresh_snapshots(self):
+        now = fields.Datetime.now()
+        dashboards = self.search([('snapshot_enabled', '=', True)]).filtered(
+            lambda d: not d.snapshot_date or d.snapshot_date + timedelta(hours=d.snapshot_ttl) <= now
+        )
+        for dashboard in dashboards:
+            try:
+                dashboard.action_refresh_snapshot()
+            except Exception:
+                _logger.exception('Snapshot of the dashboard %s failed', dashboard.name)
@@ -0,0 +1,234 @@
+odoo.define('dashboard_frame.smart_analytics.iframe_host', function (require) {
+    "use strict";
+
+    /**
+     * Host keeping the dashboard iframes alive between two navigations.
+     *
+     * Moving an iframe in the DOM reloads it, so the iframes live in a fixed
+     * container attached to the body and are laid over the placeholder rendered
+     * by the url2iframe widget. Released iframes are only hidden, up to the pool
+     * size: reopening a recently viewed dashboard does not download it again.
+     */
+
+    var Class = require('web.Class');
+    var core = require('web.core');
+    var rpc = require('web.rpc');
+
+    var QWeb = core.qweb;
+
+    var DEFAULT_POOL_SIZE = 4;
+
+    var IframeHost = Class.extend({
+        init: function () {
+            this.entries = [];
+            this.poolSize = DEFAULT_POOL_SIZE;
+            this.origins = {};
+            this.$container = null;
+            this.configLoaded = false;
+            this._onReposition = _.throttle(this._repositionAll.bind(this), 50);
+        },
+
+        //--------------------------------------------------------------------------
+        // Public
+        //--------------------------------------------------------------------------
+
+        /**
+         * Load the pool size and preconnect to the origins of all the dashboards
+         * of the user, once per page load.
+         */
+        loadConfig: function () {
+            var self = this;
+            if (this.configLoaded) {
+                return;
+            }
+            this.configLoaded = true;
+            rpc.query({
+                model: 'smart.analytics.dashboard',
+                method: 'get_iframe_host_config',
+                args: [],
+            }).then(function (config) {
+                self.poolSize = config.pool_size || DEFAULT_POOL_SIZE;
+                _.each(config.urls, self.preconnect.bind(self));
+                self._trim();
+            });
+        },
+        /**
+         * Add preconnect/dns-prefetch hints for the origin of the given url.
+         *
+         * @param {string} url
+         */
+        preconnect: function (url) {
+            var origin;
+            try {
+                origin = new URL(url, window.location.href).origin;
+            } catch (e) {
+                return;
+            }
+            if (origin === window.location.origin || this.origins[origin]) {
+                return;
+            }
+            this.origins[origin] = true;
+            $('<link>', {rel: 'preconnect', href: origin, crossorigin: ''}).appendTo(document.head);
+            $('<link>', {rel: 'dns-prefetch', href: origin}).appendTo(document.head);
+        },
+        /**
+         * Lay the iframe of the given url over the placeholder. The iframe is
+         * taken from the pool when the url was recently displayed.
+         *
+         * @param {string} url
+         * @param {HTMLElement} placeholder
+         * @returns {Object} entry to give back to release()
+         */
+        attach: function (url, placeholder) {
+            var entry = _.findWhere(this.entries, {url: url});
+            if (entry) {
+                this.entries = _.without(this.entries, entry);
+            } else {
+                entry = this._createEntry(url);
+            }
+            this.entries.push(entry);
+            if (entry.placeholder) {
+                this._unobserve(entry);
+            }
+            entry.placeholder = placeholder;
+            this._observe(entry);
+            this._position(entry);
+            // Once shown, the entry can't be evicted
+            this._trim();
+            return entry;
+        },
+        /**
+         * Hide the iframe of the entry, it stays in the pool until evicted.
+         *
+         * @param {Object} entry
+         */
+        release: function (entry) {
+            if (!entry.placeholder) {
+                return;
+            }
+            this._unobserve(entry);
+            entry.placeholder = null;
+            entry.$iframe.addClass('d-none');
+            if (!_.some(this.entries, 'placeholder')) {
+                this._toggleListeners(false);
+            }
+            this._trim();
+        },
+
+        //--------------------------------------------------------------------------
+        // Private
+        //--------------------------------------------------------------------------
+
+        _getContainer: function () {
+            if (!this.$container) {
+                this.$container = $('<div>', {class: 'o_smartanalytics_iframe_host'}).css({
+                    position: 'fixed',
+                    top: 0,
+                    left: 0,
+                    width: 0,
+                    height: 0,
+                    'z-index': 1,
+                }).appendTo(document.body);
+            }
+            return this.$container;
+        },
+        _createEntry: function (url) {
+            this.preconnect(url);
+            var $iframe = $(QWeb.render('smartanalytics.iframe.frame', {url: url}));
+            $iframe.addClass('d-none').css('position', 'absolute');
+            $iframe.appendTo(this._getContainer());
+            return {url: url, $iframe: $iframe, loaded: false, placeholder: null};
+        },
+        /**
+         * Only set the src of the iframe once its placeholder is visible.
+         */
+        _load: function (entry) {
+            if (!entry.loaded) {
+                entry.loaded = true;
+                entry.$iframe.attr('src', entry.url);
+            }
+        },
+        _observe: function (entry) {
+            var self = this;
+            this._toggleListeners(true);
+            if (window.ResizeObserver) {
+                entry.resizeObserver = new ResizeObserver(function () {
+                    self._position(entry);
+                });
+                entry.resizeObserver.observe(entry.placeholder);
+            }
+            if (entry.loaded) {
+                return;
+            }
+            if (!window.IntersectionObserver) {
+                this._load(entry);
+                return;
+            }
+            entry.intersectionObserver = new IntersectionObserver(function (observed) {
+                if (_.some(observed, 'isIntersecting')) {
+                    self._load(entry);
+                    entry.intersectionObserver.disconnect();
+                    entry.intersectionObserver = null;
+                }
+            });
+            entry.intersectionObserver.observe(entry.placeholder);
+        },
+        _unobserve: function (entry) {
+            if (entry.resizeObserver) {
+                entry.resizeObserver.disconnect();
+                entry.resizeObserver = null;
+            }
+            if (entry.intersectionObserver) {
+                entry.intersectionObserver.disconnect();
+                entry.intersectionObserver = null;
+            }
+        },
+        _position: function (entry) {
+            if (!entry.placeholder) {
+                return;
+            }
+            var rect = entry.placeholder.getBoundingClientRect();
+            if (!rect.width || !rect.height) {
+                entry.$iframe.addClass('d-none');
+                return;
+            }
+            entry.$iframe.css({
+                top: rect.top,
+                left: rect.left,
+                width: rect.width,
+                height: rect.height,
+            }).removeClass('d-none');
+        },
+        _repositionAll: function () {
+            _.each(this.entries, this._position.bind(this));
+        },
+        _toggleListeners: function (active) {
+            if (active === !!this.listening) {
+                return;
+            }
+            this.listening = active;
+            var method = active ? 'addEventListener' : 'removeEventListener';
+            window[method]('resize', this._onReposition);
+            window[method]('scroll', this._onReposition, true);
+        },
+        /**
+         * Evict the least recently used iframes which are not displayed.
+         */
+        _trim: function () {
+            var overflow = this.entries.length - this.poolSize;
+            var evicted = _.filter(this.entries, function (entry) {
+                if (overflow > 0 && !entry.placeholder) {
+                    overflow--;
+                    return true;
+                }
+                return false;
+            });
+            _.each(evicted, function (entry) {
+                entry.$iframe.remove();
+            });
+            this.entries = _.difference(this.entries, evicted);
+        },
+    });
+
+    return new IframeHost();
+});
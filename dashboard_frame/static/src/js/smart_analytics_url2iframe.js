@@ -4,6 +4,7 @@ odoo.define('dashboard_frame.smart_analytics.url2iframe', function (require) {
     var AbstractField = require('web.AbstractField');
     var core = require('web.core');
     var fieldRegistry = require('web.field_registry');
+    var iframeHost = require('dashboard_frame.smart_analytics.iframe_host');
 
     var QWeb = core.qweb;
 
@@ -11,10 +12,46 @@ odoo.define('dashboard_frame.smart_analytics.url2iframe', function (require) {
     var FieldUrl2Iframe = AbstractField.extend({
         className: 'd-block o_field_url2iframe m-0 h-100',
 
+        init: function () {
+            this._super.apply(this, arguments);
+            this.hostEntry = null;
+            iframeHost.loadConfig();
+        },
+        destroy: function () {
+            this._releaseIframe();
+            this._super.apply(this, arguments);
+        },
+        on_attach_callback: function () {
+            this._attachIframe();
+        },
+        on_detach_callback: function () {
+            this._releaseIframe();
+        },
+
+        //--------------------------------------------------------------------------
+        // Private
+        //--------------------------------------------------------------------------
+
+        _attachIframe: function () {
+            var placeholder = this.el.querySelector('.o_smartanalytics_iframe_placeholder');
+            if (placeholder && document.body.contains(placeholder)) {
+                this.hostEntry = iframeHost.attach(this.value, placeholder);
+            }
+        },
+        _releaseIframe: function () {
+            if (this.hostEntry) {
+                iframeHost.release(this.hostEntry);
+                this.hostEntry = null;
+            }
+        },
         _render: function () {
+            this._releaseIframe();
             this.$el.html(QWeb.render('smartanalytics.iframe', {
                 url: this.value,
             }));
+            if (this.value) {
+                this._attachIframe();
+            }
         },
     });
 
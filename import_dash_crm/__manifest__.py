@@ -12,7 +12,7 @@
     'version': '0.1',
 
     # any module necessary for this one to work correctly
-    'depends': ['base', 'crm', 'dashboard_frame'],
+    'depends': ['base', 'crm', 'dashboard_frame', 'smartanalytics_extractor'],
 
     # always loaded
     'data': [
@@ -12,7 +12,7 @@
     'version': '0.1',
 
     # any module necessary for this one to work correctly
-    'depends': ['base', 'sale_management', 'dashboard_frame'],
+    'depends': ['base', 'sale_management', 'dashboard_frame', 'smartanalytics_extractor'],
 
     # always loaded
     'data': [
@@ -1 +1,10 @@
+from . import cli
+from . import controllers
 from . import models
+from .models.smartanalytics_extractor_change import drop_all_capture_triggers
+
+
+def uninstall_hook(cr, registry):
+    # The capture triggers write in the change log, they must not outlive it
+    drop_all_capture_triggers(cr)
+    cr.execute("DROP FUNCTION IF EXISTS smartanalytics_capture_upsert(), smartanalytics_capture_delete()")
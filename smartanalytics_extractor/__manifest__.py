@@ -14,4 +14,5 @@
         'views/smartanalytics_extractor.xml',
     ],
     'installable': True,
+    'uninstall_hook': 'uninstall_hook',
 }
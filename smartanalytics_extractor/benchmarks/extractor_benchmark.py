@@ -0,0 +1,287 @@
+"""
+Benchmark of the extractor loaders on synthetic datasets.
+
+Run it from an Odoo shell on a database where the extractor modules to measure are installed::
+
+    $ odoo-bin shell -d <database>
+    >>> from odoo.addons.smartanalytics_extractor.benchmarks import extractor_benchmark
+    >>> extractor_benchmark.run(env, sizes=[10000, 1000000], loaders=['prepare', 'mysql', 'bigquery'])
+    >>> extractor_benchmark.run(env, sizes=[1000000], loaders=['mysql'], engines=['sequential', 'pipeline'])
+
+The datasets are temporary PostgreSQL tables shaped like account_move_line and sale_order_line,
+generated with generate_series. The loaders write into local stand-ins: an in-memory SQLite
+database for MySQL and MsSQL, and a mocked client for BigQuery, which still serializes the
+payload. Everything is done in a savepoint rolled back at the end: nothing is kept in the database.
+
+For each dataset, size, loader and extraction engine, the benchmark reports the rows per second, the peak RSS of
+the process and the time spent in each phase.
+"""
+import json
+import re
+import resource
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from unittest import mock
+
+SIZES = (10000, 1000000, 10000000)
+
+DATASETS = {
+    'account_move_line': {
+        'table': 'smartanalytics_bench_aml',
+        'create': """
+            CREATE TEMP TABLE smartanalytics_bench_aml AS
+            SELECT i AS id,
+                   (i / 10) + 1 AS move_id,
+                   'INV/2022/' || lpad(((i / 10) + 1)::text, 8, '0') AS move_name,
+                   'Invoice line ' || i AS name,
+                   round((random() * 10000)::numeric, 2)::float AS debit,
+                   round((random() * 10000)::numeric, 2)::float AS credit,
+                   round((random() * 20000 - 10000)::numeric, 2)::float AS balance,
+                   date '2018-01-01' + (i %% 1500) AS date,
+                   date '2018-01-31' + (i %% 1500) AS date_maturity,
+                   (i %% 7) + 1 AS account_id,
+                   (i %% 3 = 0) AS reconciled,
+                   now() - (i %% 100000) * interval '1 minute' AS write_date
+            FROM generate_series(1, %s) AS i
+        """,
+        'fields': [
+            ('aml_id', 'id', 'INT'),
+            ('aml_move_id', 'move_id', 'INT'),
+            ('am_name', 'move_name', 'STRING'),
+            ('aml_name', 'name', 'STRING'),
+            ('aml_debit', 'debit', 'FLOAT'),
+            ('aml_credit', 'credit', 'FLOAT'),
+            ('aml_balance', 'balance', 'FLOAT'),
+            ('aml_date', 'date', 'DATE'),
+            ('aml_date_maturity', 'date_maturity', 'DATE'),
+            ('aml_account_id', 'account_id', 'INT'),
+            ('aml_reconciled', 'reconciled', 'BOOL'),
+            ('aml_write_date', 'write_date', 'DATETIME'),
+        ],
+    },
+    'sale_order_line': {
+        'table': 'smartanalytics_bench_sol',
+        'create': """
+            CREATE TEMP TABLE smartanalytics_bench_sol AS
+            SELECT i AS id,
+                   (i / 5) + 1 AS order_id,
+                   'S' || lpad(((i / 5) + 1)::text, 8, '0') AS order_name,
+                   '[PROD-' || (i %% 500) || '] Product ' || (i %% 500) AS product_name,
+                   (i %% 20) + 1 AS product_uom_qty,
+                   round((random() * 500)::numeric, 2)::float AS price_unit,
+                   round((random() * 10000)::numeric, 2)::float AS price_subtotal,
+                   (ARRAY['draft', 'sent', 'sale', 'done', 'cancel'])[(i %% 5) + 1] AS state,
+                   timestamp '2018-01-01' + (i %% 2000) * interval '1 day' AS date_order,
+                   (i %% 50 = 0) AS is_downpayment
+            FROM generate_series(1, %s) AS i
+        """,
+        'fields': [
+            ('sol_id', 'id', 'INT'),
+            ('so_id', 'order_id', 'INT'),
+            ('so_name', 'order_name', 'STRING'),
+            ('product_name', 'product_name', 'STRING'),
+            ('sol_product_uom_qty', 'product_uom_qty', 'INT'),
+            ('sol_price_unit', 'price_unit', 'FLOAT'),
+            ('sol_price_subtotal', 'price_subtotal', 'FLOAT'),
+            ('sol_state', 'state', 'STRING'),
+            ('so_date_order', 'date_order', 'DATETIME'),
+            ('sol_is_downpayment', 'is_downpayment', 'BOOL'),
+        ],
+    },
+}
+
+
+class PhaseRecorder:
+    """ Accumulate the time spent in named phases. """
+
+    def __init__(self):
+        self.phases = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def wrap(self, name, function):
+        def wrapper(*args, **kwargs):
+            with self.phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    @property
+    def total(self):
+        return sum(self.phases.values())
+
+
+class SQLiteCursor:
+    """ Stand-in for a MySQL or MsSQL cursor, writing into an in-memory SQLite database. """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = connection.cursor()
+
+    @staticmethod
+    def _translate(query):
+        query = query.replace('%s', '?')
+        return re.sub(r'\((MAX|\d+(,\s*\d+)?)\)', '', query)
+
+    def execute(self, query, params=()):
+        return self._cursor.execute(self._translate(query), params or ())
+
+    def executemany(self, query, seq_of_params):
+        return self._cursor.executemany(self._translate(query), seq_of_params)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _create_extract(env, dataset, backend_type, engine):
+    backend = env['smartanalytics.extractor.backend'].create({
+        'name': 'Benchmark %s' % (backend_type or 'extract'),
+        'type': backend_type,
+        'engine': engine,
+    })
+    Extract = env['smartanalytics.extractor.extract']
+    columns = ',\n'.join('%s AS %s' % (source, column) for column, source, dwh_type in dataset['fields'])
+    vals = {
+        'name': 'Benchmark %s' % dataset['table'],
+        'backend_id': backend.id,
+        'table': dataset['table'],
+        'query': 'SELECT %s\nFROM %s' % (columns, dataset['table']),
+        'field_ids': [
+            (0, 0, {'column': column, 'dwh_name': column, 'dwh_type': dwh_type, 'sequence': i})
+            for i, (column, source, dwh_type) in enumerate(dataset['fields'])
+        ],
+    }
+    if 'dataset' in Extract._fields:
+        vals['dataset'] = 'smartanalytics_benchmark'
+    return Extract.with_context(smartanalytics_defer_query_check=True).create(vals)
+
+
+def _bench_prepare(env, dataset, recorder, engine):
+    """ Source query, then conversion of the rows to named data (the BigQuery payload). """
+    extract = _create_extract(env, dataset, False, engine)
+    with recorder.phase('query'):
+        env.cr.execute(extract.query)
+        rows = env.cr.fetchall()
+    with recorder.phase('convert'):
+        list(map(extract._dwh_to_named_data, rows))
+    return len(rows)
+
+
+def _bench_sql(env, dataset, recorder, engine, backend_type):
+    extract = _create_extract(env, dataset, backend_type, engine)
+    prefix = '_%s_' % backend_type
+    # The pipelined engine writes from another thread
+    connection = sqlite3.connect(':memory:', check_same_thread=False)
+    cursor = SQLiteCursor(connection)
+    with recorder.phase('drop'):
+        getattr(extract, prefix + 'drop_table')(cursor)
+    with recorder.phase('create'):
+        getattr(extract, prefix + 'create_table')(cursor)
+    with recorder.phase('insert'):
+        getattr(extract, prefix + 'insert_into_table')(cursor)
+    with recorder.phase('commit'):
+        connection.commit()
+    rows = connection.execute('SELECT count(*) FROM %s' % dataset['table']).fetchone()[0]
+    connection.close()
+    return rows
+
+
+def _bench_bigquery(env, dataset, recorder, engine):
+    extract = _create_extract(env, dataset, 'bigquery', engine)
+    loaded = []
+
+    def load_table_from_json(rows, *args, **kwargs):
+        # A real client serializes every row to JSON before the upload
+        payload = '\n'.join(json.dumps(row) for row in rows)
+        loaded.append(len(rows))
+        return mock.MagicMock(result=mock.MagicMock(return_value=len(payload)))
+
+    client = mock.MagicMock(project='smartanalytics-benchmark')
+    client.load_table_from_json.side_effect = recorder.wrap('upload', load_table_from_json)
+    with recorder.phase('create'):
+        extract._bq_create_dataset_table(client)
+    with mock.patch.object(type(extract), '_prepare_dwh_datas',
+                           recorder.wrap('prepare', type(extract)._prepare_dwh_datas)):
+        extract._bq_import_datas(client)
+    return sum(loaded)
+
+
+LOADERS = {
+    'prepare': (None, _bench_prepare),
+    'mysql': ('_mysql_insert_into_table',
+              lambda env, dataset, recorder, engine: _bench_sql(env, dataset, recorder, engine, 'mysql')),
+    'mssql': ('_mssql_insert_into_table',
+              lambda env, dataset, recorder, engine: _bench_sql(env, dataset, recorder, engine, 'mssql')),
+    'bigquery': ('_bq_import_datas', _bench_bigquery),
+}
+
+
+def run(env, sizes=(SIZES[0],), datasets=tuple(DATASETS), loaders=tuple(LOADERS), engines=('sequential',)):
+    """ Run the benchmark and print its report.
+
+    :param env: Odoo environment, e.g. the one of an Odoo shell
+    :param sizes: numbers of rows of the synthetic datasets (see SIZES)
+    :param datasets: names of the datasets to generate (see DATASETS)
+    :param loaders: loaders to measure (see LOADERS), the loaders of the modules
+        which are not installed are skipped
+    :param engines: extraction engines of the backends, 'sequential' and/or 'pipeline'
+    :return: list of result dicts
+    """
+    Extract = env['smartanalytics.extractor.extract']
+    results = []
+    env.cr.execute('SAVEPOINT smartanalytics_benchmark')
+    try:
+        for dataset_name in datasets:
+            dataset = DATASETS[dataset_name]
+            for size in sizes:
+                env.cr.execute('DROP TABLE IF EXISTS %s' % dataset['table'])
+                env.cr.execute(dataset['create'], (size,))
+                env.cr.execute('ANALYZE %s' % dataset['table'])
+                for loader in loaders:
+                    method, bench = LOADERS[loader]
+                    if method and not hasattr(Extract, method):
+                        continue
+                    for engine in engines:
+                        recorder = PhaseRecorder()
+                        rss_before = _peak_rss_mb()
+                        rows = bench(env, dataset, recorder, engine)
+                        result = {
+                            'dataset': dataset_name,
+                            'size': size,
+                            'loader': loader,
+                            'engine': engine,
+                            'rows': rows,
+                            'seconds': recorder.total,
+                            'rows_per_second': rows / recorder.total if recorder.total else 0.0,
+                            'peak_rss_mb': _peak_rss_mb(),
+                            'peak_rss_growth_mb': _peak_rss_mb() - rss_before,
+                            'phases': dict(recorder.phases),
+                        }
+                        results.append(result)
+                        _print_result(result)
+                        Extract.invalidate_cache()
+    finally:
+        env.cr.execute('ROLLBACK TO SAVEPOINT smartanalytics_benchmark')
+        env.clear()
+    return results
+
+
+def _print_result(result):
+    phases = ', '.join('%s %.3fs' % (name, seconds) for name, seconds in result['phases'].items())
+    print('%(dataset)-18s %(size)10d rows  %(loader)-9s %(engine)-10s %(rows_per_second)12.0f rows/s  '
+          'peak RSS %(peak_rss_mb)8.1f MB (+%(peak_rss_growth_mb).1f)' % result + '  [%s]' % phases)
@@ -0,0 +1,176 @@
+import argparse
+import collections
+import logging
+import sys
+import threading
+from concurrent import futures
+from pathlib import Path
+
+import psycopg2
+
+import odoo
+from odoo import SUPERUSER_ID, api
+from odoo.cli import Command
+from odoo.service import db as db_service
+from odoo.sql_db import db_connect
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+ExtractJob = collections.namedtuple('ExtractJob', 'database backend_id extract_id target')
+
+
+class SmartanalyticsExtract(Command):
+    """ Run the Smart Analytics extracts of many databases """
+
+    def run(self, cmdargs):
+        parser = argparse.ArgumentParser(
+            prog=f'{Path(sys.argv[0]).name} {self.__class__.__name__.lower()}',
+            description=self.__doc__.strip(),
+        )
+        parser.add_argument('-c', '--config', dest='config', help='Odoo configuration file')
+        parser.add_argument('-d', '--database', dest='databases',
+                            help='Comma separated databases. By default, every database where '
+                                 'smartanalytics_extractor is installed.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Maximum number of extracts running at once, all databases together.')
+        parser.add_argument('--target-workers', type=int, default=2,
+                            help='Maximum number of extracts running at once on the same datawarehouse.')
+        args, odoo_args = parser.parse_known_args(cmdargs)
+        config.parse_config((['-c', args.config] if args.config else []) + odoo_args)
+
+        databases = args.databases.split(',') if args.databases else _get_extractor_databases()
+        orchestrator = ExtractOrchestrator(databases, args.workers, args.target_workers)
+        sys.exit(0 if orchestrator.run() else 1)
+
+
+def _get_extractor_databases():
+    databases = []
+    for database in db_service.list_dbs(force=True):
+        try:
+            with db_connect(database).cursor() as cr:
+                cr.execute("""
+                    SELECT 1 FROM ir_module_module WHERE name = 'smartanalytics_extractor' AND state = 'installed'
+                """)
+                if cr.fetchone():
+                    databases.append(database)
+        except psycopg2.Error:
+            # Not an Odoo database
+            continue
+    return databases
+
+
+class ExtractOrchestrator:
+    """ Run the extracts of many databases from one process.
+
+    At most ``workers`` extracts run at once, and at most ``target_workers`` of them write in the same
+    datawarehouse (see ``_get_target_key`` of the backends), whatever their database. The databases are
+    served in turn, one extract each, so that every one of them progresses, and the extracts of a database
+    are started by decreasing estimated cost. The post-extract code of a backend runs once all its
+    extracts are done.
+    """
+
+    def __init__(self, databases, workers=4, target_workers=2):
+        self.databases = databases
+        self.workers = max(workers, 1)
+        self.target_workers = max(target_workers, 1)
+        self.failed_jobs = []
+
+    def run(self):
+        """ Run the extracts of the databases.
+
+        :return: True if all the extracts were run without error
+        """
+        queues = collections.OrderedDict()
+        remaining_extracts = collections.Counter()
+        post_extract_jobs = {}
+        for database in self.databases:
+            jobs, post_jobs = self._get_jobs(database)
+            for job in jobs:
+                remaining_extracts[(database, job.backend_id)] += 1
+            for job in post_jobs:
+                if remaining_extracts[(database, job.backend_id)]:
+                    post_extract_jobs[(database, job.backend_id)] = job
+                else:
+                    # A backend without extract runs its post-extract code right away
+                    jobs.append(job)
+            if jobs:
+                queues[database] = collections.deque(jobs)
+
+        running = {}
+        running_by_target = collections.Counter()
+        with futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='smartanalytics') as executor:
+            while queues or running:
+                # One round: the next runnable job of each database in turn, while there are free workers
+                for database in list(queues):
+                    if len(running) >= self.workers:
+                        break
+                    job = self._pop_runnable_job(queues[database], running_by_target)
+                    if job is None:
+                        continue
+                    if not queues[database]:
+                        del queues[database]
+                    else:
+                        queues.move_to_end(database)
+                    running_by_target[job.target] += 1
+                    running[executor.submit(self._run_job, job)] = job
+                if not running:
+                    break
+                done, not_done = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    running_by_target[job.target] -= 1
+                    if not future.result():
+                        self.failed_jobs.append(job)
+                    if job.extract_id is None:
+                        continue
+                    backend = (job.database, job.backend_id)
+                    remaining_extracts[backend] -= 1
+                    if not remaining_extracts[backend] and backend in post_extract_jobs:
+                        queues.setdefault(job.database, collections.deque()).appendleft(
+                            post_extract_jobs.pop(backend))
+        _logger.info('Smart Analytics extracts of %s databases done, %s failed jobs',
+                     len(self.databases), len(self.failed_jobs))
+        return not self.failed_jobs
+
+    def _pop_runnable_job(self, queue, running_by_target):
+        """ Remove and return the first job of the queue whose datawarehouse has a free worker. """
+        for index, job in enumerate(queue):
+            if running_by_target[job.target] < self.target_workers:
+                del queue[index]
+                return job
+        return None
+
+    def _get_jobs(self, database):
+        """ Return the jobs of the extracts of the database, and those of the post-extract code of the backends. """
+        jobs, post_jobs = [], []
+        try:
+            with odoo.registry(database).cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                backends = env['smartanalytics.extractor.backend'].search([('type', '!=', False)])
+                targets = {backend: backend._get_target_key() for backend in backends}
+                # The heaviest extracts of the database first, so that they don't end the night alone
+                for extract in backends.extract_ids._sorted_by_cost():
+                    jobs.append(ExtractJob(database, extract.backend_id.id, extract.id, targets[extract.backend_id]))
+                for backend in backends.filtered('post_extract_code'):
+                    post_jobs.append(ExtractJob(database, backend.id, None, targets[backend]))
+        except Exception:
+            _logger.exception('Cannot load the Smart Analytics extracts of database %s', database)
+        return jobs, post_jobs
+
+    def _run_job(self, job):
+        """ Run the job in its own cursor. Return False if it failed. """
+        threading.current_thread().dbname = job.database
+        try:
+            with odoo.registry(job.database).cursor() as cr:
+                # The extracts writing in the same datawarehouse share a pool of target_workers connections
+                env = api.Environment(cr, SUPERUSER_ID, {'smartanalytics_connection_pool_size': self.target_workers})
+                if job.extract_id is None:
+                    env['smartanalytics.extractor.backend'].browse(job.backend_id)._run_post_extract_code()
+                    return True
+                extract = env['smartanalytics.extractor.extract'].browse(job.extract_id)
+                extract._run_import_if_changed()
+                return extract.state != 'failed'
+        except Exception:
+            _logger.exception('Smart Analytics job %s failed', job)
+            return False
@@ -0,0 +1,183 @@
+import csv
+import io
+import json
+import logging
+import zlib
+from decimal import Decimal
+
+from werkzeug.exceptions import BadRequest, Forbidden, NotFound
+
+from odoo import http
+from odoo.http import request, Response
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Rows fetched at once from the server-side cursor, and sent as one chunk of the response
+CHUNK_SIZE = 2000
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+class SmartanalyticsExtractController(http.Controller):
+
+    @http.route('/smartanalytics/extract/<int:extract_id>/export', type='http', auth='user', methods=['GET'])
+    def export_extract(self, extract_id, format='ndjson', **kwargs):
+        """ Stream the rows of the extract, with its filters and on its enabled fields, as NDJSON, CSV or
+        Arrow IPC stream. The rows are read by chunks from a server-side cursor and sent as soon as they are
+        read, gzip compressed if the client accepts it. """
+        if not request.env.user.has_group('smartanalytics_extractor.smartanalytics_extractor_group_user'):
+            raise Forbidden()
+        extract = request.env['smartanalytics.extractor.extract'].browse(extract_id).exists()
+        if not extract:
+            raise NotFound()
+        extract.check_access_rights('read')
+        extract.check_access_rule('read')
+        if format not in CONTENT_TYPES:
+            raise BadRequest('Unknown format %s, use one of: %s' % (format, ', '.join(CONTENT_TYPES)))
+        if format == 'arrow' and pyarrow is None:
+            raise BadRequest('The Arrow format requires the pyarrow python package')
+
+        # Everything needed from the ORM is read now: the request cursor is closed while streaming
+        query, params = extract._get_extract_query()
+        if format == 'ndjson':
+            encoder = _NdjsonEncoder(extract._get_named_data_converter())
+        elif format == 'csv':
+            encoder = _CsvEncoder(extract._prepare_dwh_schema())
+        else:
+            encoder = _ArrowEncoder(extract._prepare_dwh_schema())
+        chunks = _stream_rows(request.env.registry, query, params, encoder)
+
+        headers = [
+            ('Content-Type', CONTENT_TYPES[format]),
+            ('Content-Disposition', http.content_disposition(f'{extract.table}.{format}')),
+            ('Cache-Control', 'no-store'),
+        ]
+        if 'gzip' in request.httprequest.headers.get('Accept-Encoding', ''):
+            chunks = _gzip_chunks(chunks)
+            headers.append(('Content-Encoding', 'gzip'))
+        return Response(chunks, headers=headers, direct_passthrough=True)
+
+
+def _stream_rows(registry, query, params, encoder):
+    """ Yield the encoded chunks of rows of the query, read with a server-side cursor of a new transaction. """
+    with registry.cursor() as cr:
+        # A named cursor keeps the rows in PostgreSQL, only CHUNK_SIZE rows are in memory at once
+        with cr._cnx.cursor('smartanalytics_export') as server_cursor:
+            server_cursor.itersize = CHUNK_SIZE
+            server_cursor.execute(query, params)
+            try:
+                header = encoder.header()
+                if header:
+                    yield header
+                while True:
+                    rows = server_cursor.fetchmany(CHUNK_SIZE)
+                    if not rows:
+                        break
+                    yield encoder.encode(rows)
+                footer = encoder.footer()
+                if footer:
+                    yield footer
+            except Exception:
+                _logger.exception('Smart Analytics export interrupted')
+                raise
+
+
+def _gzip_chunks(chunks):
+    # wbits 31: gzip container; every chunk is flushed so the client receives it immediately
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _NdjsonEncoder:
+
+    def __init__(self, convert_row):
+        self.convert_row = convert_row
+
+    def header(self):
+        return b''
+
+    def encode(self, rows):
+        return ''.join(json.dumps(self.convert_row(row), default=str) + '\n' for row in rows).encode()
+
+    def footer(self):
+        return b''
+
+
+class _CsvEncoder:
+
+    def __init__(self, schema):
+        self.names = [name for name, dwh_type, required in schema]
+
+    def _write(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+    def header(self):
+        return self._write([self.names])
+
+    def encode(self, rows):
+        return self._write(rows)
+
+    def footer(self):
+        return b''
+
+
+class _ArrowEncoder:
+
+    def __init__(self, schema):
+        self.schema = pyarrow.schema([
+            pyarrow.field(name, _arrow_type(dwh_type), nullable=not required) for name, dwh_type, required in schema
+        ])
+        self.float_columns = [i for i, (name, dwh_type, required) in enumerate(schema)
+                              if dwh_type in ('FLOAT', 'NUMERIC')]
+        self.sink = io.BytesIO()
+        self.writer = pyarrow.ipc.new_stream(self.sink, self.schema)
+
+    def _drain(self):
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+    def header(self):
+        # The schema message is written by the stream writer
+        return self._drain()
+
+    def encode(self, rows):
+        columns = [list(column) for column in zip(*rows)]
+        for i in self.float_columns:
+            columns[i] = [float(value) if isinstance(value, Decimal) else value for value in columns[i]]
+        arrays = [pyarrow.array(column, type=field.type) for column, field in zip(columns, self.schema)]
+        self.writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema))
+        return self._drain()
+
+    def footer(self):
+        self.writer.close()
+        return self._drain()
+
+
+def _arrow_type(dwh_type):
+    return {
+        'INT': pyarrow.int64(),
+        'FLOAT': pyarrow.float64(),
+        'NUMERIC': pyarrow.float64(),
+        'BOOL': pyarrow.bool_(),
+        'STRING': pyarrow.string(),
+        'DATE': pyarrow.date32(),
+        'TIME': pyarrow.time64('us'),
+        'DATETIME': pyarrow.timestamp('us'),
+    }[dwh_type]
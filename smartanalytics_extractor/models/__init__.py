@@ -1 +1,3 @@
+from . import ir_model
 from . import smartanalytics_extractor
+from . import smartanalytics_extractor_change
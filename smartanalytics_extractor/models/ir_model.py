@@ -0,0 +1,13 @@
+from odoo import models
+
+
+class IrModel(models.Model):
+    _inherit = 'ir.model'
+
+    def unlink(self):
+        # Keep the extracts of a removed model, e.g. when its module is uninstalled, without capturing it anymore
+        extracts = self.env['smartanalytics.extractor.extract'].sudo().search([
+            ('cdc_enabled', '=', True), ('cdc_model_id', 'in', self.ids),
+        ])
+        extracts.write({'cdc_enabled': False})
+        return super().unlink()
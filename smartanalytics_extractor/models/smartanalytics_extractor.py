@@ -1,11 +1,19 @@
 import datetime
+import hashlib
+import json
 import re
+from collections import Counter, defaultdict
+
+import psycopg2
 
 from odoo import api, fields, models, _
 from odoo.exceptions import ValidationError
 from odoo.tools.safe_eval import test_expr, _SAFE_OPCODES, to_opcodes
 from odoo.tools.misc import ustr
 
+from ..tools.pipeline import run_pipeline
+from ..tools.quarantine import ErrorBudgetExceeded, Quarantine
+
 
 def _check_python_code(code):
     if code:
@@ -28,6 +36,36 @@ def _check_python_code(code):
             raise ValidationError(msg)
 
 
+_JOIN_CONDITION = re.compile(r'(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)')
+
+
+def _walk_plan(node):
+    """ Return the sequential scans of the plan, as (relation, estimated rows), and the columns used as
+    join keys, as (table, column). """
+    seq_scans, conditions, aliases = [], [], {}
+    nodes = [node]
+    while nodes:
+        node = nodes.pop()
+        if node.get('Relation Name'):
+            aliases[node.get('Alias', node['Relation Name'])] = node['Relation Name']
+        if node['Node Type'] == 'Seq Scan':
+            seq_scans.append((node['Relation Name'], node['Plan Rows']))
+        for key in ('Hash Cond', 'Merge Cond', 'Join Filter'):
+            if node.get(key):
+                conditions.append(node[key])
+        if node.get('Index Cond') and node.get('Parent Relationship') == 'Inner':
+            # Parameterized index scan of a nested loop
+            conditions.append(node['Index Cond'])
+        nodes.extend(node.get('Plans', []))
+    join_keys = set()
+    for condition in conditions:
+        for match in _JOIN_CONDITION.finditer(condition):
+            for alias, column in (match.group(1, 2), match.group(3, 4)):
+                if alias in aliases:
+                    join_keys.add((aliases[alias], column))
+    return seq_scans, join_keys
+
+
 class SmartanalyticsExtractorBackend(models.Model):
     _name = 'smartanalytics.extractor.backend'
     _description = 'Smart Analytics Extractor backend'
@@ -38,9 +76,27 @@ class SmartanalyticsExtractorBackend(models.Model):
         selection=[('new', 'New'), ('succeed', 'Succeed'), ('failed', 'Failed')],
         string='State',
         compute='_compute_state',
+        store=True,
         default='new',
     )
+    extract_succeed_count = fields.Integer(string='Succeeded extracts', compute='_compute_state', store=True)
+    extract_failed_count = fields.Integer(string='Failed extracts', compute='_compute_state', store=True)
     type = fields.Selection(selection=[], string='Type')
+    engine = fields.Selection(
+        selection=[('sequential', 'Sequential'), ('pipeline', 'Pipelined')],
+        string='Extraction engine',
+        default='sequential',
+        required=True,
+        help='Sequential: each chunk of rows is read, converted then written before reading the next one.\n'
+             'Pipelined: reading, converting and writing run in parallel threads, chunk after chunk.',
+    )
+    chunk_size = fields.Integer(string='Rows per chunk', default=50000)
+    pipeline_queue_size = fields.Integer(string='Chunks in queue', default=2,
+                                         help='Maximum number of chunks waiting between two stages of the pipeline.')
+    memory_budget_mb = fields.Integer(string='Memory budget (MB)',
+                                      help='Maximum size of the rows waiting in memory to be converted or written. '
+                                           'Beyond it, they are spilled to compressed temporary files. '
+                                           '0 for no budget.')
     post_extract_code = fields.Text(string='Post-extract Code',
                                     help="Write Python code that will be executed after the extract.\n")
 
@@ -49,15 +105,34 @@ class SmartanalyticsExtractorBackend(models.Model):
     def _default_python_code(self):
         return ""
 
+    @api.depends('extract_ids.state')
     def _compute_state(self):
+        # Count the states of the extracts of all the backends at once
+        counts_by_backend = defaultdict(Counter)
+        stored_backends = self.filtered(lambda r: isinstance(r.id, int))
+        if stored_backends:
+            groups = self.env['smartanalytics.extractor.extract'].read_group(
+                [('backend_id', 'in', stored_backends.ids)], ['backend_id', 'state'], ['backend_id', 'state'],
+                lazy=False,
+            )
+            for group in groups:
+                counts_by_backend[group['backend_id'][0]][group['state']] = group['__count']
         for record in self:
-            states = [extract.state for extract in record.extract_ids]
-            if 'failed' in states:
-                self.state = 'failed'
-            elif (['succeed'] * len(states)) == states:
-                self.state = 'succeed'
+            if isinstance(record.id, int):
+                counts = counts_by_backend[record.id]
+            else:
+                counts = Counter(record.extract_ids.mapped('state'))
+            if counts['failed']:
+                state = 'failed'
+            elif counts['succeed'] == sum(counts.values()):
+                state = 'succeed'
             else:
-                self.state = 'new'
+                state = 'new'
+            record.update({
+                'state': state,
+                'extract_succeed_count': counts['succeed'],
+                'extract_failed_count': counts['failed'],
+            })
 
     @api.constrains('post_extract_code')
     def _check_post_extract_code(self):
@@ -72,16 +147,32 @@ class SmartanalyticsExtractorBackend(models.Model):
         for record in self:
             if not record.type:
                 raise ValidationError(_('Type field are empty'))
-            for extract in record.extract_ids:
-                extract.action_run_import()
-            # Python script to run after the extract
-            if record.post_extract_code:
-                exec(record.post_extract_code.strip(), {}, record._get_eval_context())
+            for extract in record.extract_ids._sorted_by_cost():
+                extract._run_import_if_changed()
+            record._run_post_extract_code()
+
+    def _run_post_extract_code(self):
+        self.ensure_one()
+        # Python script to run after the extract
+        if self.post_extract_code:
+            exec(self.post_extract_code.strip(), {}, self._get_eval_context())
 
     def _get_eval_context(self):
         self.ensure_one()
         return {}
 
+    def _get_target_key(self):
+        """ Return the key of the datawarehouse written by the backend. When the extracts of many databases
+        are run by the orchestrator, the backends with the same key share their concurrency limit and, if
+        their type supports it, a connection pool. """
+        self.ensure_one()
+        return (self.type, self.env.cr.dbname, self.id)
+
+    def _get_memory_budget(self):
+        """ Return the memory budget of the backend, in bytes. 0 if there is no budget. """
+        self.ensure_one()
+        return max(self.memory_budget_mb, 0) * 1024 * 1024
+
 
 class SmartanalyticsExtractorExtract(models.Model):
     _name = 'smartanalytics.extractor.extract'
@@ -102,30 +193,177 @@ class SmartanalyticsExtractorExtract(models.Model):
         default='new',
         required=True,
     )
+    query_check_pending = fields.Boolean(string='Query check pending', readonly=True, copy=False,
+                                         help='The query will be checked by a background job.')
+    key_column = fields.Char(string='Key column',
+                             help='Column of the query holding the ID of the records of the captured model.')
+    cdc_enabled = fields.Boolean(string='Change data capture',
+                                 help='Capture the changes of the records of a model, and only apply the rows of '
+                                      'the changed records to the datawarehouse, every few minutes.')
+    cdc_model_id = fields.Many2one('ir.model', string='Captured model', ondelete='set null')
+    cdc_snapshot = fields.Char(string='Last applied snapshot', readonly=True, copy=False,
+                               help='PostgreSQL snapshot of the last applied changes: the changes committed after '
+                                    'it are applied next.')
+    filter_date_column = fields.Char(string='Date column',
+                                     help='Column of the query holding the date of the rows, to only extract the '
+                                          'rows of the last months.')
+    filter_months = fields.Integer(string='Months to extract', help='0 to extract the full history.')
+    filter_company_column = fields.Char(string='Company column',
+                                        help='Column of the query holding the ID of the company of the rows.')
+    filter_company_ids = fields.Many2many('res.company', string='Companies',
+                                          help='Only extract the rows of these companies. All when empty.')
+    filter_state_column = fields.Char(string='State column', help='Column of the query holding the state of the rows.')
+    filter_states = fields.Char(string='States', help='Comma separated states of the rows to extract, e.g. posted,cancel')
+    skip_unchanged = fields.Boolean(string='Skip unchanged loads',
+                                    help='Before running the extract with the other extracts of the backend, compare '
+                                         'the fingerprint of its rows with the one of the last successful import, '
+                                         'and skip the import if they match.')
+    fingerprint_date_column = fields.Char(string='Fingerprint date column',
+                                          help='Column of the query whose maximum changes when rows are modified, '
+                                               'e.g. write_date.')
+    fingerprint_key_columns = fields.Char(string='Fingerprint key columns',
+                                          help='Comma separated columns of the query to checksum. By default, the '
+                                               'key column with a date column, else the whole rows: without a '
+                                               'date column, the changes of the other columns are not detected.')
+    last_fingerprint = fields.Char(string='Last fingerprint', readonly=True, copy=False)
+    plan_date = fields.Datetime(string='Analyzed on', readonly=True, copy=False)
+    plan_cost = fields.Float(string='Estimated cost', readonly=True, copy=False,
+                             help='Total cost of the query estimated by the PostgreSQL planner, in arbitrary units. '
+                                  'The heaviest extracts are run first.')
+    plan_rows = fields.Integer(string='Estimated rows', readonly=True, copy=False)
+    plan_warnings = fields.Text(string='Plan warnings', readonly=True, copy=False)
+    plan_index_suggestions = fields.Text(string='Suggested indexes', readonly=True, copy=False)
+    plan = fields.Text(string='Query plan', readonly=True, copy=False)
+    max_rejected_rows = fields.Integer(string='Rejected rows allowed',
+                                       help='Rows which can\'t be loaded (wrong type, empty required value) are '
+                                            'rejected, the others are loaded. The import fails when the rejected '
+                                            'rows exceed the largest of the allowed rows and percentage.')
+    max_rejected_ratio = fields.Float(string='Rejected rows allowed (%)')
+    rejected_count = fields.Integer(string='Rejected rows', readonly=True, copy=False)
+    rejected_attachment_id = fields.Many2one('ir.attachment', string='Rejected rows file', readonly=True, copy=False)
+    dwh_schema = fields.Text(string='Datawarehouse schema', readonly=True, copy=False,
+                             help='Schema of the datawarehouse table, as JSON, when it was last imported or '
+                                  'synchronized.')
 
     # post_extract_code = fields.Text(string='Post-extract Code', help="Write Python code that will be executed after the extract.")
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        pending = self._is_query_check_deferred()
+        for vals in vals_list:
+            vals['query_check_pending'] = pending
+        records = super().create(vals_list)
+        if any(records.mapped('cdc_enabled')):
+            self.env['smartanalytics.extractor.change']._sync_capture_triggers()
+        return records
+
+    def write(self, vals):
+        if 'query' in vals or 'field_ids' in vals:
+            vals['query_check_pending'] = self._is_query_check_deferred()
+        if vals.get('cdc_enabled') or 'cdc_model_id' in vals:
+            # Only the changes committed from now on will be applied
+            self.env.cr.execute("SELECT txid_current_snapshot()::text")
+            vals['cdc_snapshot'] = self.env.cr.fetchone()[0]
+        res = super().write(vals)
+        if 'cdc_enabled' in vals or 'cdc_model_id' in vals:
+            self.env['smartanalytics.extractor.change']._sync_capture_triggers()
+        return res
+
+    def unlink(self):
+        cdc = any(self.mapped('cdc_enabled'))
+        res = super().unlink()
+        if cdc:
+            self.env['smartanalytics.extractor.change']._sync_capture_triggers()
+        return res
+
+    @api.model
+    def _is_query_check_deferred(self):
+        """ Queries loaded by a module (e.g. the import_dash_* data packs) are checked by a background
+        job instead of during the installation. Set the parameter
+        `smartanalytics_extractor.defer_install_query_check` to False to check them at install time. """
+        if 'smartanalytics_defer_query_check' in self.env.context:
+            return bool(self.env.context['smartanalytics_defer_query_check'])
+        if not self.env.context.get('install_module'):
+            return False
+        defer = self.env['ir.config_parameter'].sudo().get_param(
+            'smartanalytics_extractor.defer_install_query_check', 'True')
+        return defer not in ('0', 'False', 'false')
+
     @api.constrains('query', 'field_ids')
     def _check_query_and_shema(self):
         for record in self:
             # Check if query starts with SELECT
             if not record.query.strip().startswith('SELECT '):
                 raise ValidationError(_("Queries must be SELECT query"))
-            # Prepare fields and run query
-            schema_fields = record.field_ids.mapped('column')
-            self.env.cr.execute(record.query)
-            for column in self.env.cr.description:
-                # Check if column (of the query) is in fields
-                if column.name not in schema_fields:
-                    raise ValidationError(
-                        _('The column "%s" of the query is not defined in fields') % column.name
-                    )
-                schema_fields.remove(column.name)
-            # Check if there are fields that are not in query
-            if schema_fields:
+            if not record.query_check_pending:
+                record._check_query_columns()
+
+    def _check_query_columns(self):
+        self.ensure_one()
+        # Prepare fields and describe the query, without fetching any row
+        schema_fields = self.field_ids.mapped('column')
+        query = self.query.strip().rstrip(';')
+        try:
+            with self.env.cr.savepoint():
+                # The newline ends a comment on the last line of the query
+                self.env.cr.execute(f"SELECT * FROM ({query}\n) AS smartanalytics_query LIMIT 0")
+                description = self.env.cr.description
+        except psycopg2.Error as error:
+            raise ValidationError(_('The query is not valid:\n%s') % error)
+        for column in description:
+            # Check if column (of the query) is in fields
+            if column.name not in schema_fields:
                 raise ValidationError(
-                    _('The following fields are not in the query: %s') % ' ,'.join(schema_fields)
+                    _('The column "%s" of the query is not defined in fields') % column.name
                 )
+            schema_fields.remove(column.name)
+        # Check if there are fields that are not in query
+        if schema_fields:
+            raise ValidationError(
+                _('The following fields are not in the query: %s') % ' ,'.join(schema_fields)
+            )
+
+    @api.constrains('key_column', 'cdc_enabled', 'cdc_model_id', 'field_ids')
+    def _check_cdc(self):
+        for record in self:
+            if record.key_column and record.key_column not in record.field_ids.mapped('column'):
+                raise ValidationError(_('The key column "%s" is not defined in fields') % record.key_column)
+            if record.cdc_enabled and not (record.key_column and record.cdc_model_id):
+                raise ValidationError(_('Change data capture requires a captured model and a key column'))
+            if record.cdc_enabled and not record._get_key_field().enabled:
+                raise ValidationError(_('The key column "%s" must be enabled') % record.key_column)
+
+    @api.constrains('filter_date_column', 'filter_company_column', 'filter_state_column', 'field_ids')
+    def _check_filters(self):
+        for record in self:
+            columns = record.field_ids.mapped('column')
+            for column in (record.filter_date_column, record.filter_company_column, record.filter_state_column):
+                if column and column not in columns:
+                    raise ValidationError(_('The filter column "%s" is not defined in fields') % column)
+            if record.field_ids and not record._get_enabled_fields():
+                raise ValidationError(_('At least one field of the extract must be enabled'))
+
+    @api.constrains('fingerprint_date_column', 'fingerprint_key_columns', 'field_ids')
+    def _check_fingerprint(self):
+        for record in self:
+            columns = record.field_ids.mapped('column')
+            for column in [record.fingerprint_date_column] + record._get_fingerprint_key_columns():
+                if column and column not in columns:
+                    raise ValidationError(_('The fingerprint column "%s" is not defined in fields') % column)
+
+    @api.model
+    def _cron_check_pending_queries(self):
+        for record in self.search([('query_check_pending', '=', True)]):
+            try:
+                record._check_query_columns()
+            except ValidationError as error:
+                record.write({
+                    'query_check_pending': False,
+                    'state': 'failed',
+                    'log': f'Query check failed !!\n\nErrors:\n{error}',
+                })
+            else:
+                record.query_check_pending = False
 
     # @api.constrains('post_extract_code')
     # def _check_post_extract_code(self):
@@ -152,38 +390,421 @@ class SmartanalyticsExtractorExtract(models.Model):
         )
         return columns
 
+    def _get_enabled_fields(self):
+        self.ensure_one()
+        return self.field_ids.filtered('enabled')
+
+    def _get_extract_columns(self):
+        """ Return the columns of the query to extract, i.e. those of the enabled fields, in the order of the query. """
+        self.ensure_one()
+        enabled_columns = set(self._get_enabled_fields().mapped('column'))
+        return [column for column in self._get_columns_from_query() if column in enabled_columns]
+
     def _prepare_dwh_schema(self):
         self.ensure_one()
         fields_mapping = {}
         for field in self.field_ids:
             fields_mapping[field.column] = field.dwh_get_field()
         result = []
-        for column in self._get_columns_from_query():
+        for column in self._get_extract_columns():
             result.append(fields_mapping[column])
         return result
 
-    def _dwh_to_named_data(self, row):
+    def _get_named_data_converter(self, columns=None):
+        """ Return a function converting a row of the query to a dict of values named by the datawarehouse
+        fields. The function doesn't use the ORM, it can be called from the threads of the pipeline.
+
+        :param columns: columns of the rows, the enabled ones by default
+        """
         self.ensure_one()
-        res = {}
         column_names = dict([(field.column, field.dwh_name) for field in self.field_ids])
-        columns = self._get_columns_from_query()
-        for i, column in enumerate(columns):
-            if isinstance(row[i], datetime.date):
-                res[column_names[column]] = row[i].strftime('%Y-%m-%d')
-            elif isinstance(row[i], datetime.datetime):
-                res[column_names[column]] = row[i].strftime('%Y-%m-%d %H:%M:%S')
-            else:
-                res[column_names[column]] = row[i]
-        return res
+        names = [column_names[column] for column in columns or self._get_extract_columns()]
+
+        def convert_row(row):
+            res = {}
+            for name, value in zip(names, row):
+                if isinstance(value, datetime.date):
+                    res[name] = value.strftime('%Y-%m-%d')
+                elif isinstance(value, datetime.datetime):
+                    res[name] = value.strftime('%Y-%m-%d %H:%M:%S')
+                else:
+                    res[name] = value
+            return res
+        return convert_row
+
+    def _dwh_to_named_data(self, row):
+        self.ensure_one()
+        return self._get_named_data_converter()(row)
+
+    def _get_filter_conditions(self):
+        """ Return the SQL conditions of the filters of the extract on the columns of its query.
+
+        :return: tuple (list of conditions, list of their parameters)
+        """
+        self.ensure_one()
+        conditions, params = [], []
+        if self.filter_date_column and self.filter_months > 0:
+            conditions.append(f"{self.filter_date_column} >= current_date - make_interval(months => %s)")
+            params.append(self.filter_months)
+        if self.filter_company_column and self.filter_company_ids:
+            conditions.append(f"{self.filter_company_column} = ANY(%s)")
+            params.append(self.filter_company_ids.ids)
+        states = [state.strip() for state in (self.filter_states or '').split(',') if state.strip()]
+        if self.filter_state_column and states:
+            conditions.append(f"{self.filter_state_column} = ANY(%s)")
+            params.append(states)
+        return conditions, params
+
+    def _get_extract_query(self, keys=None, project=True, columns=None):
+        """ Return the query selecting the rows to extract: the query of the extract, restricted by its
+        filters and projected on its enabled fields, so PostgreSQL only reads what is sent to the datawarehouse.
+
+        :param keys: if given, only select the rows whose key column is in ``keys``
+        :param project: if False, select all the columns of the query
+        :param columns: if given, select these columns instead of the enabled ones
+        :return: tuple (query, params), params is None if the query has no parameter
+        """
+        self.ensure_one()
+        # The query may be wrapped in another one, a final ; would end it
+        query = self.query.strip().rstrip(';').rstrip()
+        conditions, params = self._get_filter_conditions()
+        if keys is not None:
+            conditions.append(f"{self.key_column} = ANY(%s)")
+            params.append(list(keys))
+        if columns is not None:
+            project = True
+        elif project:
+            columns = self._get_extract_columns()
+        else:
+            columns = self._get_columns_from_query()
+        if not conditions and columns == self._get_columns_from_query():
+            return query, None
+        if params:
+            # The query is a parameter-less one, escape its % before adding the parameters of the filters
+            query = query.replace('%', '%%')
+        select = ', '.join(f'smartanalytics_query.{column}' for column in columns) if project else '*'
+        # The newline ends a comment on the last line of the query
+        query = f"SELECT {select} FROM ({query}\n) AS smartanalytics_query"
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(f'smartanalytics_query.{condition}' for condition in conditions)
+        return query, params or None
+
+    def _execute_query(self, keys=None, columns=None):
+        """ Execute the query of the extract, with its filters and on its enabled fields.
 
-    def _prepare_dwh_datas(self):
-        self.env.cr.execute(self.query)
-        rows_to_insert = list(map(self._dwh_to_named_data, self.env.cr.fetchall()))
+        :param keys: if given, only select the rows whose key column is in ``keys``
+        :param columns: if given, select these columns instead of the enabled ones
+        """
+        self.ensure_one()
+        query, params = self._get_extract_query(keys, columns=columns)
+        self.env.cr.execute(query, params)
+
+    def _prepare_dwh_datas(self, keys=None):
+        convert_row = self._get_named_data_converter()
+        quarantine = self._start_quarantine()
+        self._execute_query(keys)
+        rows = quarantine.filter(self.env.cr.fetchall())
+        self._end_quarantine(quarantine)
+        rows_to_insert = list(map(convert_row, rows))
         return rows_to_insert
 
+    def _start_quarantine(self, columns=None):
+        """ Return the quarantine validating the rows of the query, to call in the conversion stage.
+
+        :param columns: columns of the rows, the enabled ones by default
+        """
+        self.ensure_one()
+        fields_by_column = {field.column: field for field in self.field_ids}
+        columns = columns or self._get_extract_columns()
+        return Quarantine([fields_by_column[column].dwh_get_field() for column in columns])
+
+    def _end_quarantine(self, quarantine, store=True):
+        """ Store the rows rejected by the quarantine in an attachment of the extract, before loading the others.
+
+        :param store: if False, only check the error budget: the rejected rows of a backfill don't replace those
+            of the last load of the table
+        :raise ErrorBudgetExceeded: if the rejected rows exceed the error budget of the extract
+        """
+        self.ensure_one()
+        if store:
+            self.rejected_attachment_id.unlink()
+            attachment = self.env['ir.attachment']
+            if quarantine.rejected_count:
+                attachment = attachment.create({
+                    'name': f'{self.table}_rejected_rows.csv',
+                    'raw': quarantine.get_csv(),
+                    'mimetype': 'text/csv',
+                    'res_model': self._name,
+                    'res_id': self.id,
+                })
+            self.write({
+                'rejected_count': quarantine.rejected_count,
+                'rejected_attachment_id': attachment.id,
+            })
+        budget = max(self.max_rejected_rows, self.max_rejected_ratio * quarantine.total_count / 100)
+        if quarantine.rejected_count > budget:
+            message = _('%s rows on %s were rejected, more than the error budget of the extract (%s rows).') % (
+                quarantine.rejected_count, quarantine.total_count, int(budget))
+            raise ErrorBudgetExceeded(message + (_(' See the rejected rows file.') if store else ''))
+
+    def _get_rejected_log(self):
+        self.ensure_one()
+        if not self.rejected_count:
+            return ''
+        return f'\n\n{self.rejected_count} rejected rows, see {self.rejected_attachment_id.name}'
+
+    def _read_chunks(self, keys=None, chunk_size=None, columns=None):
+        """ Execute the query of the extract and yield its rows by chunks.
+
+        The rows are read with a server-side cursor, in the current transaction: they stay in PostgreSQL until
+        fetched, only one chunk is in memory at once and each chunk is fetched while the previous ones are
+        transformed and written.
+        """
+        self.ensure_one()
+        chunk_size = max(chunk_size or self.backend_id.chunk_size, 1)
+        query, params = self._get_extract_query(keys, columns=columns)
+        with self.env.cr._cnx.cursor(f'smartanalytics_extract_{self.id}') as server_cursor:
+            server_cursor.itersize = chunk_size
+            server_cursor.execute(query, params)
+            while True:
+                rows = server_cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield rows
+
+    def _run_pipeline(self, transform, write, keys=None, chunk_size=None, columns=None):
+        """ Read the rows of the extract by chunks, then transform and write each chunk, with the extraction
+        engine of the backend. The rows are read in the current thread, ``transform`` and ``write`` may run in
+        other threads: prepare everything they need from the ORM before. """
+        self.ensure_one()
+        backend = self.backend_id
+        run_pipeline(
+            self._read_chunks(keys, chunk_size, columns), transform, write,
+            threaded=backend.engine == 'pipeline', queue_size=backend.pipeline_queue_size,
+            memory_budget=backend._get_memory_budget(),
+        )
+
+    def _get_fingerprint_key_columns(self):
+        self.ensure_one()
+        if self.fingerprint_key_columns:
+            return [column.strip() for column in self.fingerprint_key_columns.split(',') if column.strip()]
+        # The key column only detects added and removed rows: the date column detects the modified ones
+        return [self.key_column] if self.key_column and self.fingerprint_date_column else []
+
+    def _compute_fingerprint(self):
+        """ Return the fingerprint of the rows to extract, computed by PostgreSQL: number of rows, maximum of
+        the date column and order independent checksum of the key columns (or of the whole rows). The query
+        and the filters of the extract are part of it, so changing them invalidates it. """
+        self.ensure_one()
+        query, params = self._get_extract_query(project=False)
+        key_columns = self._get_fingerprint_key_columns()
+        if key_columns:
+            checksum_of = 'ROW(%s)::text' % ', '.join(f'smartanalytics_rows.{column}' for column in key_columns)
+        else:
+            checksum_of = 'smartanalytics_rows::text'
+        max_date = f'max(smartanalytics_rows.{self.fingerprint_date_column})::text' \
+            if self.fingerprint_date_column else 'NULL'
+        # Sum of the first 64 bits of the md5 of each row: constant memory, whatever the order of the rows
+        self.env.cr.execute(f"""
+            SELECT count(*), {max_date}, coalesce(sum(('x' || left(md5({checksum_of}), 16))::bit(64)::bigint), 0)
+            FROM ({query}
+            ) AS smartanalytics_rows
+        """, params)
+        count, max_date, checksum = self.env.cr.fetchone()
+        definition = repr((self.query, self._get_filter_conditions()))
+        return '%s|%s|%s|%s' % (count, max_date or '', checksum, hashlib.md5(definition.encode()).hexdigest())
+
+    def _run_import_if_changed(self):
+        """ Run the import of the extracts, except those skipping unchanged loads whose fingerprint matches
+        the one of their last successful import. """
+        for record in self:
+            fingerprint = False
+            if record.skip_unchanged:
+                try:
+                    with self.env.cr.savepoint():
+                        fingerprint = record._compute_fingerprint()
+                except psycopg2.Error as error:
+                    record.write({
+                        'state': 'failed',
+                        'log': f'Fingerprint failed !!\n\nErrors:\n{error}',
+                    })
+                    continue
+                if record.state == 'succeed' and fingerprint == record.last_fingerprint:
+                    if record._is_schema_changed():
+                        # Same datas, new fields: alter the table instead of reloading it
+                        record.action_sync_schema()
+                        continue
+                    record.log = f'Import skipped, the datas are unchanged since the last import !\n\n' \
+                                 f'Fingerprint: {fingerprint}'
+                    continue
+            record.action_run_import()
+            if record.state == 'succeed':
+                record.last_fingerprint = fingerprint
+
+    def action_analyze(self):
+        """ Explain the query of the extracts and store the estimates of the planner, the sequential scans,
+        the join keys without index and the indexes which would support them. """
+        for record in self:
+            query, params = record._get_extract_query()
+            try:
+                with self.env.cr.savepoint():
+                    self.env.cr.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+                    plan = self.env.cr.fetchone()[0]
+            except psycopg2.Error as error:
+                raise ValidationError(_('The query of the extract "%s" cannot be analyzed:\n%s') % (record.name, error))
+            root = plan[0]['Plan']
+            seq_scans, join_keys = _walk_plan(root)
+            warnings = [
+                _('Sequential scan on %s (%s estimated rows)') % (relation, rows) for relation, rows in seq_scans
+            ]
+            suggestions = []
+            for table, column in sorted(join_keys):
+                if not record._has_leading_index(table, column):
+                    warnings.append(_('No index on the join key %s.%s') % (table, column))
+                    suggestions.append(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {table}_{column}_index '
+                                       f'ON {table} ({column});')
+            record.write({
+                'plan_date': fields.Datetime.now(),
+                'plan_cost': root['Total Cost'],
+                'plan_rows': root['Plan Rows'],
+                'plan_warnings': '\n'.join(warnings),
+                'plan_index_suggestions': '\n'.join(suggestions),
+                'plan': json.dumps(plan, indent=2),
+            })
+
+    def _has_leading_index(self, table, column):
+        """ Return whether an index of the table starts with the column. """
+        self.env.cr.execute("""
+            SELECT 1
+            FROM pg_index AS i
+            JOIN pg_class AS c ON c.oid = i.indrelid
+            JOIN pg_attribute AS a ON a.attrelid = c.oid AND a.attnum = i.indkey[0]
+            WHERE c.relname = %s AND a.attname = %s
+            LIMIT 1
+        """, (table, column))
+        return bool(self.env.cr.fetchone())
+
+    def _sorted_by_cost(self):
+        """ Return the extracts, the heaviest first according to their last analysis. """
+        return self.sorted(lambda extract: extract.plan_cost, reverse=True)
+
+    def _get_key_field(self):
+        self.ensure_one()
+        return self.field_ids.filtered(lambda field: field.column == self.key_column)[:1]
+
+    def _cdc_get_changes(self):
+        """ Return the changes of the captured model which are not applied yet: those which were not visible
+        in the snapshot of the last applied changes. The IDs of the changes can't be used as a watermark: they
+        are assigned at insert, so a change committed late may have an ID lower than the applied ones.
+
+        :return: tuple (snapshot of the returned changes, list of the IDs of the changed records)
+        """
+        self.ensure_one()
+        # The snapshot is the one of the statement: it sees exactly the returned changes
+        self.env.cr.execute("""
+            SELECT array_agg(DISTINCT res_id), txid_current_snapshot()::text
+            FROM smartanalytics_extractor_change
+            WHERE model = %s AND (%s::txid_snapshot IS NULL OR NOT txid_visible_in_snapshot(txid, %s::txid_snapshot))
+        """, (self.cdc_model_id.model, self.cdc_snapshot or None, self.cdc_snapshot or None))
+        keys, snapshot = self.env.cr.fetchone()
+        return snapshot, keys or []
+
     def action_run_import(self):
         return
 
+    def _get_import_succeed_vals(self, log):
+        """ Return the values of the extract after a successful import: the schema of the table is the one of
+        the extract. The fingerprint of the imported rows is unknown, the one of a former import is cleared.
+        """
+        self.ensure_one()
+        return {
+            'log': log,
+            'state': 'succeed',
+            'dwh_schema': self._dump_schema(),
+            'last_fingerprint': False,
+        }
+
+    def action_apply_changes(self):
+        """ Apply the captured changes to the datawarehouse: the rows of the changed records are deleted
+        from the table, then selected again from the query and inserted. """
+        return
+
+    def action_sync_schema(self):
+        """ Alter the datawarehouse table of the extracts to match their schema, without reloading it: the
+        missing columns are added then backfilled from the query, by key column, and the columns which are
+        not required anymore, or not extracted anymore, become nullable. Other changes, like a new type,
+        require an import. The extracts without an enabled key column are imported again. """
+        for record in self:
+            if record._is_type_changed():
+                # The types of the existing columns are not altered
+                added_fields = None
+            else:
+                try:
+                    # A failed read of the backfill must not abort the transaction
+                    with self.env.cr.savepoint():
+                        added_fields = record._dwh_sync_schema()
+                except Exception as error:
+                    record.write({
+                        'log': f'Schema synchronization failed !!\n\nErrors:\n{error}',
+                        'state': 'failed',
+                    })
+                    continue
+            if added_fields is None:
+                record.action_run_import()
+                continue
+            record.write({
+                'log': record._get_sync_schema_log(added_fields),
+                'state': 'succeed',
+                'dwh_schema': record._dump_schema(),
+            })
+
+    def _dwh_sync_schema(self):
+        """ Alter the datawarehouse table to match the schema of the extract, and backfill the added columns.
+
+        :return: the added fields, or None if the extract must be imported instead (no table, no key column)
+        """
+        self.ensure_one()
+        return None
+
+    def _dump_schema(self):
+        self.ensure_one()
+        return json.dumps(self._prepare_dwh_schema())
+
+    def _is_schema_changed(self):
+        """ Return whether the schema changed since the table was last imported or synchronized. """
+        self.ensure_one()
+        return bool(self.dwh_schema) and self.dwh_schema != self._dump_schema()
+
+    def _is_type_changed(self):
+        """ Return whether a field of the table has a new type since it was last imported or synchronized. """
+        self.ensure_one()
+        if not self.dwh_schema:
+            return False
+        last_types = {name: dwh_type for name, dwh_type, required in json.loads(self.dwh_schema)}
+        return any(name in last_types and last_types[name] != dwh_type
+                   for name, dwh_type, required in self._prepare_dwh_schema())
+
+    def _can_backfill(self):
+        """ Return whether the new columns can be backfilled, instead of importing the extract again. """
+        self.ensure_one()
+        return bool(self.key_column) and bool(self._get_key_field().enabled)
+
+    def _get_sync_schema_log(self, added_fields):
+        self.ensure_one()
+        if not added_fields:
+            return 'Schema synchronized successfully !'
+        return 'Schema synchronized successfully !\n\nAdded and backfilled columns: %s' % ', '.join(
+            added_fields.mapped('dwh_name'))
+
+    @api.model
+    def _cron_apply_changes(self):
+        extracts = self.search([('cdc_enabled', '=', True)])
+        changed_schema = extracts.filtered(lambda extract: extract._is_schema_changed())
+        changed_schema.action_sync_schema()
+        # The changes can't be applied to a table which misses columns
+        (extracts - changed_schema.filtered(lambda extract: extract.state == 'failed')).action_apply_changes()
+        self.env['smartanalytics.extractor.change']._purge()
+
 
 class SmartanalyticsExtractorExtractField(models.Model):
     _name = 'smartanalytics.extractor.extract.field'
@@ -197,6 +818,8 @@ class SmartanalyticsExtractorExtractField(models.Model):
     dwh_name = fields.Char(string='DWH field name', required=True)
     dwh_type = fields.Selection(selection='_selection_type', string='DWH field type', required=True)
     dwh_required = fields.Boolean(string='DWH field required')
+    enabled = fields.Boolean(string='Enabled', default=True,
+                             help='Disabled fields are neither selected from the query nor sent to the datawarehouse.')
     sequence = fields.Integer(string='Sequence', default=10)
 
     @api.model
@@ -0,0 +1,120 @@
+from odoo import api, fields, models
+
+TRIGGER_PREFIX = 'smartanalytics_cdc'
+
+
+class SmartanalyticsExtractorChange(models.Model):
+    """ Compact log of the inserted, updated and deleted records of the models captured by extracts
+    in change data capture mode. Rows are written by PostgreSQL triggers, not by the ORM. """
+    _name = 'smartanalytics.extractor.change'
+    _description = 'Smart Analytics Extractor captured change'
+    _log_access = False
+    _order = 'id'
+
+    model = fields.Char(string='Model', required=True, index=True)
+    res_id = fields.Integer(string='Record ID', required=True)
+    operation = fields.Selection(
+        selection=[('upsert', 'Insert or update'), ('delete', 'Delete')],
+        string='Operation',
+        required=True,
+    )
+
+    def init(self):
+        # Transaction of the change, to know in which snapshots it is visible: not an ORM field, as a bigint
+        self.env.cr.execute("""
+            ALTER TABLE smartanalytics_extractor_change
+            ADD COLUMN IF NOT EXISTS txid bigint NOT NULL DEFAULT txid_current()
+        """)
+        # Statement level triggers: one insert in the log per statement, whatever the number of rows
+        self.env.cr.execute("""
+            CREATE OR REPLACE FUNCTION smartanalytics_capture_upsert() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO smartanalytics_extractor_change (model, res_id, operation)
+                SELECT TG_ARGV[0], id, 'upsert' FROM smartanalytics_new_rows;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION smartanalytics_capture_delete() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO smartanalytics_extractor_change (model, res_id, operation)
+                SELECT TG_ARGV[0], id, 'delete' FROM smartanalytics_old_rows;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+        """)
+
+    @api.model
+    def _sync_capture_triggers(self):
+        """ Install the capture triggers on the tables of the models captured by an extract,
+        and remove them from the tables which are not captured anymore. """
+        extracts = self.env['smartanalytics.extractor.extract'].sudo().search([
+            ('cdc_enabled', '=', True), ('cdc_model_id', '!=', False),
+        ])
+        wanted = {}
+        for model_name in set(extracts.mapped('cdc_model_id.model')):
+            if model_name in self.env and not self.env[model_name]._abstract:
+                wanted[self.env[model_name]._table] = model_name
+        existing = _get_captured_tables(self.env.cr)
+        for table in existing - set(wanted):
+            _drop_capture_triggers(self.env.cr, table)
+        for table in set(wanted) - existing:
+            self.env.cr.execute(f"""
+                CREATE TRIGGER {TRIGGER_PREFIX}_insert AFTER INSERT ON "{table}"
+                REFERENCING NEW TABLE AS smartanalytics_new_rows
+                FOR EACH STATEMENT EXECUTE PROCEDURE smartanalytics_capture_upsert(%s);
+                CREATE TRIGGER {TRIGGER_PREFIX}_update AFTER UPDATE ON "{table}"
+                REFERENCING NEW TABLE AS smartanalytics_new_rows
+                FOR EACH STATEMENT EXECUTE PROCEDURE smartanalytics_capture_upsert(%s);
+                CREATE TRIGGER {TRIGGER_PREFIX}_delete AFTER DELETE ON "{table}"
+                REFERENCING OLD TABLE AS smartanalytics_old_rows
+                FOR EACH STATEMENT EXECUTE PROCEDURE smartanalytics_capture_delete(%s);
+            """, (wanted[table],) * 3)
+
+    @api.model
+    def _purge(self):
+        """ Remove the changes applied by all the extracts capturing their model: visible in the snapshots of
+        their last applied changes. """
+        self.env.cr.execute("""
+            DELETE FROM smartanalytics_extractor_change AS change
+            USING (
+                SELECT model.model, array_agg(extract.cdc_snapshot) AS snapshots
+                FROM smartanalytics_extractor_extract AS extract
+                JOIN ir_model AS model ON model.id = extract.cdc_model_id
+                WHERE extract.cdc_enabled
+                GROUP BY model.model
+            ) AS applied
+            WHERE change.model = applied.model AND NOT EXISTS (
+                SELECT 1 FROM unnest(applied.snapshots) AS snapshot
+                WHERE snapshot IS NULL OR NOT txid_visible_in_snapshot(change.txid, snapshot::txid_snapshot)
+            )
+        """)
+        self.env.cr.execute("""
+            DELETE FROM smartanalytics_extractor_change
+            WHERE model NOT IN (
+                SELECT model.model
+                FROM smartanalytics_extractor_extract AS extract
+                JOIN ir_model AS model ON model.id = extract.cdc_model_id
+                WHERE extract.cdc_enabled
+            )
+        """)
+
+
+def _get_captured_tables(cr):
+    cr.execute("""
+        SELECT DISTINCT c.relname
+        FROM pg_trigger AS t
+        JOIN pg_class AS c ON c.oid = t.tgrelid
+        WHERE t.tgname = %s
+    """, (f'{TRIGGER_PREFIX}_insert',))
+    return {row[0] for row in cr.fetchall()}
+
+
+def _drop_capture_triggers(cr, table):
+    for operation in ('insert', 'update', 'delete'):
+        cr.execute(f'DROP TRIGGER IF EXISTS {TRIGGER_PREFIX}_{operation} ON "{table}"')
+
+
+def drop_all_capture_triggers(cr):
+    for table in _get_captured_tables(cr):
+        _drop_capture_triggers(cr, table)
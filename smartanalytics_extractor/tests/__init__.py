@@ -0,0 +1,2 @@
+from . import test_extract
+from . import test_tools
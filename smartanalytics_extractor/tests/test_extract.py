@@ -0,0 +1,31 @@
+from odoo.tests.common import TransactionCase
+
+
+class TestExtract(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.backend = cls.env['smartanalytics.extractor.backend'].create({'name': 'Test backend'})
+        cls.extract = cls.env['smartanalytics.extractor.extract'].create({
+            'name': 'Partners',
+            'backend_id': cls.backend.id,
+            'table': 'partners',
+            'query': 'SELECT id, name FROM res_partner;\n',
+            'key_column': 'id',
+            'skip_unchanged': True,
+            'field_ids': [
+                (0, 0, {'column': 'id', 'dwh_name': 'id', 'dwh_type': 'INT', 'dwh_required': True, 'sequence': 1}),
+                (0, 0, {'column': 'name', 'dwh_name': 'name', 'dwh_type': 'STRING', 'sequence': 2}),
+            ],
+        })
+
+    def test_query_semicolon(self):
+        """ A query ending with ; can be wrapped, with or without projection. """
+        query, params = self.extract._get_extract_query()
+        self.assertFalse(query.endswith(';'))
+        self.assertTrue(self.extract._compute_fingerprint())
+        self.extract.field_ids.filtered(lambda field: field.column == 'name').enabled = False
+        self.assertTrue(self.extract._compute_fingerprint())
+        self.extract._execute_query()
+        self.assertTrue(self.env.cr.fetchall())
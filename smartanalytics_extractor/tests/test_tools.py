@@ -0,0 +1,106 @@
+import datetime
+import threading
+import time
+from decimal import Decimal
+
+from odoo.tests.common import BaseCase
+
+from ..tools.pipeline import run_pipeline
+from ..tools.quarantine import Quarantine
+from ..tools.spill import SpillQueue
+
+
+class TestPipeline(BaseCase):
+
+    def _run_pipeline(self, chunks, transform, **kwargs):
+        """ Run the pipeline in a thread, failing the test instead of hanging it. """
+        written = []
+        errors = []
+
+        def run():
+            try:
+                run_pipeline(chunks, transform, written.append, **kwargs)
+            except Exception as error:
+                errors.append(error)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive(), 'The pipeline did not finish')
+        if errors:
+            raise errors[0]
+        return written
+
+    def test_pipeline(self):
+        chunks = [[i] * 10 for i in range(20)]
+        written = self._run_pipeline(iter(chunks), lambda chunk: [value * 2 for value in chunk])
+        self.assertEqual(written, [[i * 2] * 10 for i in range(20)])
+
+    def test_pipeline_sequential(self):
+        chunks = [[i] * 10 for i in range(20)]
+        written = self._run_pipeline(iter(chunks), list, threaded=False)
+        self.assertEqual(written, chunks)
+
+    def test_pipeline_memory_budget(self):
+        """ With a slow stage the chunks, and the end of stream after them, exceed the budget. """
+        def transform(chunk):
+            time.sleep(0.01)
+            return chunk
+        chunks = [[i] * 500 for i in range(50)]
+        written = self._run_pipeline(iter(chunks), transform, memory_budget=20000)
+        self.assertEqual(written, chunks)
+
+    def test_pipeline_error(self):
+        def transform(chunk):
+            if chunk[0] == 5:
+                raise ValueError('Wrong chunk')
+            return chunk
+        chunks = ([i] * 10 for i in range(1000))
+        with self.assertRaises(ValueError):
+            self._run_pipeline(chunks, transform, memory_budget=20000)
+
+
+class TestSpillQueue(BaseCase):
+
+    def test_spill(self):
+        spill_queue = SpillQueue(1000)
+        chunks = [[i] * 100 for i in range(5)]
+        for chunk in chunks:
+            spill_queue.put(chunk)
+        self.assertEqual(spill_queue.spilled_count, 4)
+        self.assertEqual([spill_queue.get() for chunk in chunks], chunks)
+        self.assertEqual(spill_queue.memory_size, 0)
+
+    def test_no_spill(self):
+        spill_queue = SpillQueue(1000)
+        control = object()
+        spill_queue.put([0] * 100)
+        spill_queue.put(control, spill=False)
+        self.assertEqual(spill_queue.spilled_count, 0)
+        spill_queue.get()
+        self.assertIs(spill_queue.get(), control)
+
+
+class TestQuarantine(BaseCase):
+
+    def test_filter(self):
+        quarantine = Quarantine([('id', 'INT', True), ('amount', 'FLOAT', False), ('date', 'DATE', False)])
+        rows = [
+            (1, 10.5, datetime.date(2024, 1, 1)),
+            (2, None, '2024-01-31'),
+            (None, 1.0, None),
+            (4, 'ten', None),
+            (5, 1.0, '2024-02-31'),
+        ]
+        self.assertEqual(quarantine.filter(rows), rows[:2])
+        self.assertEqual((quarantine.total_count, quarantine.rejected_count), (5, 3))
+        lines = quarantine.get_csv().decode().splitlines()
+        self.assertEqual(lines[0], 'rejection_reason,id,amount,date')
+        self.assertEqual(len(lines), 4)
+
+    def test_non_finite(self):
+        quarantine = Quarantine([('amount', 'NUMERIC', False)])
+        rows = [(float('nan'),), (float('inf'),), (Decimal('NaN'),), (Decimal('-Infinity'),), ('inf',),
+                (Decimal('1.5'),)]
+        self.assertEqual(quarantine.filter(rows), [(Decimal('1.5'),)])
+        self.assertEqual(quarantine.rejected_count, 5)
+        self.assertEqual(len(quarantine.get_csv().decode().splitlines()), 6)
@@ -0,0 +1,3 @@
+from .pipeline import run_pipeline
+from .quarantine import ErrorBudgetExceeded, Quarantine
+from .spill import SpillQueue
@@ -0,0 +1,113 @@
+import queue
+import threading
+
+from .spill import SpillQueue
+
+_DONE = object()
+_POLL_TIMEOUT = 0.1
+
+
+def run_pipeline(chunks, transform, write, threaded=True, queue_size=2, memory_budget=0):
+    """ Read the chunks, transform them and write them.
+
+    When threaded, the chunks are read in the calling thread, transformed in a second thread and written in
+    a third one. The stages are connected by bounded queues, so reading chunk N+1 overlaps with transforming
+    chunk N and writing chunk N-1, while at most ``queue_size`` chunks wait between two stages.
+    ``transform`` and ``write`` run outside of the calling thread: they must not use the ORM or its cursor.
+
+    :param chunks: iterable of chunks, e.g. lists of rows fetched from the query
+    :param transform: function returning the transformed chunk
+    :param write: function writing a transformed chunk
+    :param threaded: if False, run the stages one after the other in the calling thread
+    :param queue_size: maximum number of chunks waiting between two stages
+    :param memory_budget: if set, maximum size in bytes of the chunks waiting in memory between the stages,
+        instead of ``queue_size``: the reader never waits and the chunks exceeding the budget are spilled
+        to compressed temporary files
+    """
+    if not threaded:
+        for chunk in chunks:
+            write(transform(chunk))
+        return
+    _Pipeline(transform, write, queue_size, memory_budget).run(chunks)
+
+
+class _Pipeline:
+
+    def __init__(self, transform, write, queue_size, memory_budget=0):
+        self.transform = transform
+        self.write = write
+        self.queue_size = max(queue_size, 1)
+        self.memory_budget = memory_budget
+        self.failed = threading.Event()
+        self.error = None
+
+    def run(self, chunks):
+        transform_queue = self._make_queue()
+        write_queue = self._make_queue()
+        threads = [
+            threading.Thread(target=self._stage, args=(self.transform, transform_queue, write_queue),
+                             name='smartanalytics-transform', daemon=True),
+            threading.Thread(target=self._stage, args=(self.write, write_queue, None),
+                             name='smartanalytics-write', daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for chunk in chunks:
+                if not self._put(transform_queue, chunk):
+                    break
+            self._put_done(transform_queue)
+        except BaseException:
+            # Stop the other stages before raising the error of the reader
+            self.failed.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+            for stage_queue in (transform_queue, write_queue):
+                if isinstance(stage_queue, SpillQueue):
+                    stage_queue.close()
+        if self.error is not None:
+            raise self.error
+
+    def _make_queue(self):
+        if self.memory_budget:
+            # Half of the budget for the rows to transform, half for the transformed ones
+            return SpillQueue(self.memory_budget // 2)
+        return queue.Queue(self.queue_size)
+
+    def _put(self, output, item):
+        """ Put the item in the queue, unless a stage failed. """
+        while not self.failed.is_set():
+            try:
+                output.put(item, timeout=_POLL_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _put_done(self, output):
+        """ Put the end of stream in the queue: it is compared by identity, so it is never spilled. """
+        if isinstance(output, SpillQueue):
+            output.put(_DONE, spill=False)
+            return True
+        return self._put(output, _DONE)
+
+    def _stage(self, function, input, output):
+        while not self.failed.is_set():
+            try:
+                item = input.get(timeout=_POLL_TIMEOUT)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                if output is not None:
+                    self._put_done(output)
+                return
+            try:
+                result = function(item)
+            except BaseException as error:
+                self.error = error
+                self.failed.set()
+                return
+            if output is not None and not self._put(output, result):
+                return
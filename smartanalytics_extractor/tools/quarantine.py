@@ -0,0 +1,131 @@
+import csv
+import datetime
+import math
+import tempfile
+from decimal import Decimal
+
+from odoo.exceptions import ValidationError
+
+# Size of the rejected rows kept in memory, beyond it they are written in a temporary file
+_SPOOL_SIZE = 1024 * 1024
+
+
+class ErrorBudgetExceeded(ValidationError):
+    """ The rows rejected by the validation of an extract exceed its error budget. """
+
+
+class Quarantine:
+    """ Validate the rows of an extract against the types of its fields, and keep aside, as CSV with the
+    reason of their rejection, the rows which can't be loaded. It doesn't use the ORM: rows can be filtered
+    in the threads of the pipeline. """
+
+    def __init__(self, schema):
+        """
+        :param schema: list of (name, type, required) of the columns of the rows, see ``dwh_get_schema``
+        """
+        self.validators = [_get_value_validator(name, dwh_type, required) for name, dwh_type, required in schema]
+        self.total_count = 0
+        self.rejected_count = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE, mode='w+', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(['rejection_reason'] + [name for name, dwh_type, required in schema])
+
+    def filter(self, rows):
+        """ Return the valid rows, and keep aside the others. """
+        valid_rows = []
+        for row in rows:
+            reasons = [reason for reason in (validate(value) for validate, value in zip(self.validators, row))
+                       if reason]
+            if reasons:
+                self.rejected_count += 1
+                self._writer.writerow(['; '.join(reasons)] + list(row))
+            else:
+                valid_rows.append(row)
+        self.total_count += len(rows)
+        return valid_rows
+
+    def get_csv(self):
+        """ Return the rejected rows as CSV bytes, and close the quarantine. """
+        self._file.seek(0)
+        data = self._file.read().encode()
+        self._file.close()
+        return data
+
+
+def _get_value_validator(name, dwh_type, required):
+    is_valid = _TYPE_VALIDATORS.get(dwh_type, _is_any)
+
+    def validate(value):
+        if value is None or (value is False and dwh_type != 'BOOL'):
+            return f'{name}: required value is empty' if required else None
+        if not is_valid(value):
+            return f'{name}: {value!r} is not a valid {dwh_type}'
+        return None
+    return validate
+
+
+def _is_any(value):
+    return True
+
+
+def _is_int(value):
+    if isinstance(value, int):
+        return True
+    try:
+        if isinstance(value, (float, Decimal)):
+            return value == int(value)
+        if isinstance(value, str):
+            int(value)
+            return True
+    except (ValueError, OverflowError):
+        return False
+    return False
+
+
+def _is_float(value):
+    # NaN and infinity are valid Python numbers, but not valid datawarehouse ones
+    if isinstance(value, int):
+        return True
+    if isinstance(value, Decimal):
+        return value.is_finite()
+    if isinstance(value, float):
+        return math.isfinite(value)
+    if isinstance(value, str):
+        try:
+            return math.isfinite(float(value))
+        except ValueError:
+            return False
+    return False
+
+
+def _is_bool(value):
+    return isinstance(value, bool) or value in (0, 1)
+
+
+def _is_date(value):
+    return isinstance(value, datetime.date) or _is_iso(value, datetime.date)
+
+
+def _is_time(value):
+    return isinstance(value, (datetime.time, datetime.datetime)) or _is_iso(value, datetime.time)
+
+
+def _is_iso(value, date_type):
+    if not isinstance(value, str):
+        return False
+    try:
+        date_type.fromisoformat(value)
+        return True
+    except ValueError:
+        return False
+
+
+_TYPE_VALIDATORS = {
+    'INT': _is_int,
+    'FLOAT': _is_float,
+    'NUMERIC': _is_float,
+    'BOOL': _is_bool,
+    'DATE': _is_date,
+    'TIME': _is_time,
+    'DATETIME': lambda value: isinstance(value, datetime.date) or _is_iso(value, datetime.datetime),
+}
@@ -0,0 +1,106 @@
+import collections
+import io
+import mmap
+import pickle
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from queue import Empty
+
+# Number of rows of a chunk measured to estimate the size of the whole chunk
+_SAMPLE_ROWS = 10
+
+
+def estimate_size(item):
+    """ Return the estimated size in memory, in bytes, of a chunk: a list of rows or a buffer. """
+    if isinstance(item, io.BytesIO):
+        return item.getbuffer().nbytes
+    if isinstance(item, (bytes, bytearray)):
+        return len(item)
+    if isinstance(item, list):
+        sample = item[:_SAMPLE_ROWS]
+        if not sample:
+            return sys.getsizeof(item)
+        sample_size = sum(_estimate_row_size(row) for row in sample)
+        return sys.getsizeof(item) + sample_size * len(item) // len(sample)
+    return sys.getsizeof(item)
+
+
+def _estimate_row_size(row):
+    if isinstance(row, dict):
+        values = row.values()
+    elif isinstance(row, (tuple, list)):
+        values = row
+    else:
+        return sys.getsizeof(row)
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in values)
+
+
+class SpillQueue:
+    """ Unbounded FIFO queue keeping at most ``budget`` bytes of items in memory.
+
+    The items put while the budget is exceeded are pickled, compressed and written to temporary files,
+    which are memory-mapped to be read back. It has the interface of ``queue.Queue`` used by the pipeline:
+    ``put`` never blocks, ``get`` blocks until an item is available.
+    Control items, compared by identity like the end of stream of the pipeline, must be put with
+    ``spill=False``: a spilled item is read back as a copy.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.memory_size = 0
+        self.spilled_count = 0
+        self._items = collections.deque()
+        self._not_empty = threading.Condition()
+
+    def put(self, item, block=True, timeout=None, spill=True):
+        size = estimate_size(item)
+        with self._not_empty:
+            in_memory = not spill or self.memory_size + size <= self.budget or not self._items
+        # Compress and write outside of the lock, the consumer keeps reading meanwhile
+        entry = (item, size, None) if in_memory else (None, 0, _spill(item))
+        with self._not_empty:
+            self.memory_size += entry[1]
+            self.spilled_count += 0 if in_memory else 1
+            self._items.append(entry)
+            self._not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        with self._not_empty:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._items:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise Empty
+                self._not_empty.wait(remaining)
+            item, size, spill_file = self._items.popleft()
+            self.memory_size -= size
+        if spill_file is not None:
+            item = _unspill(spill_file)
+        return item
+
+    def close(self):
+        """ Remove the temporary files of the items which were not read. """
+        with self._not_empty:
+            for item, size, spill_file in self._items:
+                if spill_file is not None:
+                    spill_file.close()
+            self._items.clear()
+            self.memory_size = 0
+
+
+def _spill(item):
+    spill_file = tempfile.TemporaryFile(prefix='smartanalytics-spill-')
+    spill_file.write(zlib.compress(pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL), 1))
+    spill_file.flush()
+    return spill_file
+
+
+def _unspill(spill_file):
+    try:
+        with mmap.mmap(spill_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return pickle.loads(zlib.decompress(data))
+    finally:
+        spill_file.close()
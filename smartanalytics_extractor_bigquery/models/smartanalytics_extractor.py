@@ -1,10 +1,16 @@
+import gzip
+import io
 import json
+import math
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from google.cloud import bigquery
 from google.oauth2 import service_account
-from google.api_core.exceptions import BadRequest
+from google.api_core.exceptions import BadRequest, GoogleAPICallError, NotFound
 from odoo import api, fields, models, _
 from odoo.exceptions import ValidationError
+from odoo.addons.smartanalytics_extractor.tools.quarantine import ErrorBudgetExceeded
 
 
 class SmartanalyticsExtractorBackend(models.Model):
@@ -41,6 +47,12 @@ class SmartanalyticsExtractorBackend(models.Model):
         client = bigquery.Client(project=self.bq_project, credentials=credentials)
         return client
 
+    def _get_target_key(self):
+        self.ensure_one()
+        if self.type == 'bigquery':
+            return ('bigquery', self.bq_project)
+        return super()._get_target_key()
+
     def _get_eval_context(self):
         eval_context = super()._get_eval_context()
         credentials = service_account.Credentials.from_service_account_info(json.loads(self.bq_credentials))
@@ -60,17 +72,67 @@ class SmartanalyticsExtractorExtract(models.Model):
     dataset_location = fields.Selection(
         selection=[('EU', 'EU'), ('US', 'US')], string='Bigquery dataset location', default='EU'
     )
+    bq_load_mode = fields.Selection(
+        selection=[('json', 'Single JSON load'), ('sharded', 'Compressed shards')],
+        string='Bigquery load mode',
+        default='json',
+        help='Compressed shards: the rows are split in gzip compressed NDJSON shards, uploaded concurrently '
+             'into a staging table which then replaces the table in a single copy job.',
+    )
+    bq_shard_count = fields.Integer(string='Bigquery shards', default=4)
 
     def action_run_import(self):
         res = super().action_run_import()
         for record in self:
-            if self.type == 'bigquery':
+            if record.type == 'bigquery':
                 client = record.backend_id._get_bq_client()
                 record._bq_create_dataset_table(client)
                 record._bq_import_datas(client)
                 client.close()
         return res
 
+    def action_apply_changes(self):
+        res = super().action_apply_changes()
+        for record in self:
+            if record.type == 'bigquery':
+                snapshot, keys = record._cdc_get_changes()
+                if not keys:
+                    continue
+                client = record.backend_id._get_bq_client()
+                try:
+                    record._bq_apply_changes(client, keys)
+                    record.log = f'{len(keys)} changed records applied successfully !' + record._get_rejected_log()
+                    record.state = 'succeed'
+                    record.cdc_snapshot = snapshot
+                except (GoogleAPICallError, ErrorBudgetExceeded) as error:
+                    record.log = f'Changes apply failed !!\n\nErrors:\n{error}'
+                    record.state = 'failed'
+                client.close()
+        return res
+
+    def _bq_apply_changes(self, client, keys):
+        self.ensure_one()
+        table_name = self._bq_get_table_name(client)
+        key_name = self._get_key_field().dwh_name
+        delete_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ArrayQueryParameter('keys', 'INT64', keys)],
+        )
+        client.query(
+            f"DELETE FROM `{table_name}` WHERE {key_name} IN UNNEST(@keys)",
+            job_config=delete_config, location=self.dataset_location,
+        ).result()
+        rows_to_insert = self._prepare_dwh_datas(keys=keys)
+        if rows_to_insert:
+            job_config = bigquery.LoadJobConfig(
+                schema=self._bq_make_schema(),
+                write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+                source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                autodetect=False,
+            )
+            client.load_table_from_json(
+                rows_to_insert, table_name, location=self.dataset_location, job_config=job_config
+            ).result()
+
     def _bq_create_dataset_table(self, client=False):
         self.ensure_one()
         # Create a client, if not given in params
@@ -115,13 +177,92 @@ class SmartanalyticsExtractorExtract(models.Model):
     def _bq_make_schema(self):
         self.ensure_one()
         result = []
-        for field in self.field_ids:
-            mode = 'REQUIRED' if field.dwh_required else 'NULLABLE'
-            field_type = 'INT64' if field.dwh_type == 'INT' else field.dwh_type
-            bq_field = bigquery.SchemaField(field.dwh_name, field_type, mode=mode)
-            result.append(bq_field)
+        for field in self._get_enabled_fields():
+            result.append(self._bq_make_schema_field(field))
         return result
 
+    def _bq_make_schema_field(self, field, nullable=False):
+        self.ensure_one()
+        mode = 'REQUIRED' if field.dwh_required and not nullable else 'NULLABLE'
+        field_type = 'INT64' if field.dwh_type == 'INT' else field.dwh_type
+        return bigquery.SchemaField(field.dwh_name, field_type, mode=mode)
+
+    def _dwh_sync_schema(self):
+        self.ensure_one()
+        if self.type != 'bigquery':
+            return super()._dwh_sync_schema()
+        client = self.backend_id._get_bq_client()
+        try:
+            table_name = self._bq_get_table_name(client)
+            try:
+                table = client.get_table(table_name)
+            except NotFound:
+                return None
+            added_fields = self._bq_alter_table(client, table)
+            if added_fields and self._can_backfill():
+                self._bq_backfill(client, table_name, added_fields)
+            elif added_fields:
+                added_fields = None
+        finally:
+            client.close()
+        return added_fields
+
+    def _bq_alter_table(self, client, table):
+        """ Add the missing columns to the table, as nullable ones, and relax to nullable the columns which
+        are not required anymore.
+
+        :return: the added fields
+        """
+        self.ensure_one()
+        fields = self._get_enabled_fields()
+        fields_by_name = {field.dwh_name.lower(): field for field in fields}
+        schema = []
+        for live_field in table.schema:
+            field = fields_by_name.pop(live_field.name.lower(), None)
+            if live_field.mode == 'REQUIRED' and not (field and field.dwh_required):
+                # The columns which are not extracted anymore are left empty by the loads
+                live_field = bigquery.SchemaField(live_field.name, live_field.field_type, mode='NULLABLE',
+                                                  description=live_field.description)
+            schema.append(live_field)
+        added_fields = fields.filtered(lambda field: field.dwh_name.lower() in fields_by_name)
+        schema += [self._bq_make_schema_field(field, nullable=True) for field in added_fields]
+        if schema != table.schema:
+            table.schema = schema
+            client.update_table(table, ['schema'])
+        return added_fields
+
+    def _bq_backfill(self, client, table_name, added_fields):
+        """ Fill the added columns of the rows of the table, from the query, by key column: the key and the
+        added columns are loaded in a staging table, then merged in the table by a single UPDATE. """
+        self.ensure_one()
+        key_field = self._get_key_field()
+        backfill_fields = key_field | added_fields
+        columns = backfill_fields.mapped('column')
+        convert_row = self._get_named_data_converter(columns)
+        quarantine = self._start_quarantine(columns)
+        rows = [convert_row(row) for chunk in self._read_chunks(columns=columns) for row in quarantine.filter(chunk)]
+        self._end_quarantine(quarantine, store=False)
+        staging_name = '%s_backfill' % table_name
+        job_config = bigquery.LoadJobConfig(
+            schema=[self._bq_make_schema_field(field, nullable=True) for field in backfill_fields],
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            autodetect=False,
+        )
+        try:
+            client.load_table_from_file(
+                _bq_gzip_ndjson(rows), staging_name, location=self.dataset_location, job_config=job_config
+            ).result()
+            assignments = ', '.join(f"{field.dwh_name} = backfill.{field.dwh_name}" for field in added_fields)
+            client.query(
+                f"UPDATE `{table_name}` AS target SET {assignments} "
+                f"FROM `{staging_name}` AS backfill "
+                f"WHERE target.{key_field.dwh_name} = backfill.{key_field.dwh_name}",
+                location=self.dataset_location,
+            ).result()
+        finally:
+            client.delete_table(staging_name, not_found_ok=True)
+
     def _bq_get_dataset_name(self, client):
         self.ensure_one()
         return '%s.%s' % (client.project, self.dataset)
@@ -140,25 +281,173 @@ class SmartanalyticsExtractorExtract(models.Model):
             client = self.backend_id._get_bq_client()
         table_name = self._bq_get_table_name(client)
         table = client.get_table(table_name)
-        rows_to_insert = self._prepare_dwh_datas()
         schema = self._bq_make_schema()
-        job_config = bigquery.LoadJobConfig(
-            schema=schema,
-            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
-            autodetect=False,
-        )
-        job = client.load_table_from_json(rows_to_insert, table, location=self.dataset_location, job_config=job_config)
+        memory_budget = self.backend_id._get_memory_budget()
         try:
-            job.result()
-            self.log = 'Import finished successfully !'
-            self.state = 'succeed'
+            if self.bq_load_mode == 'sharded':
+                jobs = self._bq_load_shards(client, table, schema)
+            elif memory_budget:
+                jobs = [self._bq_load_spooled(client, table, schema, memory_budget)]
+            else:
+                rows_to_insert = self._prepare_dwh_datas()
+                job_config = bigquery.LoadJobConfig(
+                    schema=schema,
+                    write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+                    source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                    autodetect=False,
+                )
+                jobs = [client.load_table_from_json(rows_to_insert, table, location=self.dataset_location,
+                                                    job_config=job_config)]
+        except ErrorBudgetExceeded as error:
+            # Raised before any load job: the table is left untouched
+            self.log = f'Import failed !!\n\nErrors:\n{error}'
+            self.state = 'failed'
+            if auto_close:
+                client.close()
+            return
+        try:
+            for job in jobs:
+                job.result()
+            self.write(self._get_import_succeed_vals('Import finished successfully !' + self._get_rejected_log()))
         except BadRequest:
             errors = 'Import failed !!\n\nErrors:\n'
-            for error in job.errors:
-                errors += '{}\n'.format(error['message'])
+            for job in jobs:
+                for error in job.errors or []:
+                    errors += '{}\n'.format(error['message'])
             self.log = errors + '\n\n' + str(schema)
             self.state = 'failed'
         # Close the client, if not given in params
         if auto_close:
             client.close()
+
+    def _bq_load_spooled(self, client, table, schema, memory_budget):
+        """ Load the rows as a single gzip compressed NDJSON file, written chunk by chunk in memory then,
+        beyond the memory budget, in a temporary file.
+
+        :return: the load job, to wait for
+        """
+        self.ensure_one()
+        convert_row = self._get_named_data_converter()
+        quarantine = self._start_quarantine()
+        job_config = bigquery.LoadJobConfig(
+            schema=schema,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            autodetect=False,
+        )
+        # The client only uploads files opened in read mode
+        with tempfile.SpooledTemporaryFile(max_size=memory_budget, mode='r+b', prefix='smartanalytics-spill-') as spool:
+            with gzip.GzipFile(fileobj=spool, mode='wb') as gzip_file:
+                for rows in self._read_chunks():
+                    for row in quarantine.filter(rows):
+                        gzip_file.write(json.dumps(convert_row(row), default=str).encode())
+                        gzip_file.write(b'\n')
+            self._end_quarantine(quarantine)
+            spool.seek(0)
+            return client.load_table_from_file(spool, table, location=self.dataset_location,
+                                               job_config=job_config)
+
+    def _bq_load_pipelined_shards(self, executor, load_shard, shard_count):
+        """ Read, convert and compress the rows with the pipeline into ``shard_count`` shards at most, then
+        upload them concurrently: one load job per shard, whatever the number of chunks.
+
+        :return: list of the load jobs
+        """
+        self.ensure_one()
+        convert_row = self._get_named_data_converter()
+        quarantine = self._start_quarantine()
+        # Kept in memory without budget, like the rows of the sequential engine
+        max_size = self.backend_id._get_memory_budget() // shard_count
+        # The client only uploads files opened in read mode
+        shard_files = [tempfile.SpooledTemporaryFile(max_size=max_size, mode='r+b', prefix='smartanalytics-shard-')
+                       for i in range(shard_count)]
+        try:
+            gzip_files = [gzip.GzipFile(fileobj=shard_file, mode='wb') for shard_file in shard_files]
+            written = set()
+
+            def transform(rows):
+                return _bq_ndjson(map(convert_row, quarantine.filter(rows)))
+
+            def write(data):
+                if data:
+                    # The smallest shard, so that the shards have about the same size
+                    index = min(range(shard_count), key=lambda i: gzip_files[i].tell())
+                    gzip_files[index].write(data)
+                    written.add(index)
+
+            self._run_pipeline(transform, write)
+            for gzip_file in gzip_files:
+                gzip_file.close()
+            # Raised before any load job: the table is left untouched
+            self._end_quarantine(quarantine)
+            for shard_file in shard_files:
+                shard_file.seek(0)
+            return list(executor.map(load_shard, [shard_files[index] for index in sorted(written)]))
+        finally:
+            for shard_file in shard_files:
+                shard_file.close()
+
+    def _bq_load_shards(self, client, table, schema):
+        """ Upload the rows concurrently, as gzip compressed NDJSON shards, into a staging table.
+        Once every shard is loaded, a single copy job replaces the content of the table by the staging table.
+        With the pipelined engine, the chunks of rows are converted while the next ones are read, and
+        compressed in turn into one of the shards, uploaded once all the rows are read.
+
+        :return: list of the jobs, to wait for
+        """
+        self.ensure_one()
+        staging_name = '%s_staging' % self._bq_get_table_name(client)
+        client.delete_table(staging_name, not_found_ok=True)
+        staging = client.create_table(bigquery.Table(staging_name, schema=schema))
+        job_config = bigquery.LoadJobConfig(
+            schema=schema,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            autodetect=False,
+        )
+        location = self.dataset_location
+        max_uploads = max(self.bq_shard_count, 1)
+
+        def load_shard(buffer):
+            return client.load_table_from_file(buffer, staging, location=location, job_config=job_config)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_uploads) as executor:
+                if self.backend_id.engine == 'pipeline':
+                    jobs = self._bq_load_pipelined_shards(executor, load_shard, max_uploads)
+                else:
+                    rows = self._prepare_dwh_datas()
+                    shard_size = max(math.ceil(len(rows) / max_uploads), 1)
+                    shards = [rows[i:i + shard_size] for i in range(0, len(rows), shard_size)]
+                    jobs = list(executor.map(lambda shard: load_shard(_bq_gzip_ndjson(shard)), shards))
+                # Upload errors are raised here, load errors are kept in the jobs
+                list(executor.map(_bq_wait_job, jobs))
+            if any(job.errors for job in jobs):
+                return jobs
+            copy_config = bigquery.CopyJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+            copy_job = _bq_wait_job(
+                client.copy_table(staging, table, location=location, job_config=copy_config)
+            )
+        finally:
+            client.delete_table(staging_name, not_found_ok=True)
+        return jobs + [copy_job]
+
+
+def _bq_gzip_ndjson(rows):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as gzip_file:
+        gzip_file.write(_bq_ndjson(rows))
+    buffer.seek(0)
+    return buffer
+
+
+def _bq_ndjson(rows):
+    return b''.join(json.dumps(row, default=str).encode() + b'\n' for row in rows)
+
+
+def _bq_wait_job(job):
+    try:
+        job.result()
+    except BadRequest:
+        pass
+    return job
@@ -14,6 +14,14 @@ class SmartanalyticsExtractorBackend(models.Model):
     mssql_database = fields.Char(string="MsSQL Database")
     mssql_user = fields.Char(string="MsSQL User")
     mssql_password = fields.Char(string="MsSQL Password")
+    mssql_insert_mode = fields.Selection(
+        selection=[('insert', 'Multi-row INSERT'), ('bulk', 'Bulk copy')],
+        string='MsSQL insert mode',
+        default='insert',
+        help='Bulk copy uses the bulk-copy protocol of SQL Server, it requires pymssql 2.2.8 or later.',
+    )
+    mssql_batch_size = fields.Integer(string='MsSQL batch size', default=1000,
+                                      help='Number of rows fetched, converted and sent at once.')
 
     def _default_python_code(self):
         res = super()._default_python_code()
@@ -63,6 +71,12 @@ class SmartanalyticsExtractorBackend(models.Model):
                               )
         return cnx
 
+    def _get_target_key(self):
+        self.ensure_one()
+        if self.type == 'mssql':
+            return ('mssql', self.mssql_server, self.mssql_port, self.mssql_database, self.mssql_user)
+        return super()._get_target_key()
+
     def _get_eval_context(self):
         eval_context = super()._get_eval_context()
         eval_context.update({
@@ -82,6 +96,7 @@ class SmartanalyticsExtractorExtract(models.Model):
         res = super().action_run_import()
         for record in self:
             if record.type == 'mssql':
+                cnx = None
                 try:
                     cnx = record.backend_id._get_mssql_connection()
                     cursor = cnx.cursor()
@@ -89,17 +104,51 @@ class SmartanalyticsExtractorExtract(models.Model):
                     record._mssql_create_table(cursor)
                     record._mssql_insert_into_table(cursor)
                     cnx.commit()
-                    record.log = 'Import finished successfully !'
-                    record.state = 'succeed'
+                    record.write(record._get_import_succeed_vals(
+                        'Import finished successfully !' + record._get_rejected_log()))
                 except Exception as error:
                     errors = f'Import failed !!\n\nErrors:\n{error}'
                     record.log = errors
                     record.state = 'failed'
-                else:
-                    cursor.close()
-                    cnx.close()
+                finally:
+                    if cnx is not None:
+                        cnx.close()
         return res
 
+    def action_apply_changes(self):
+        res = super().action_apply_changes()
+        for record in self:
+            if record.type == 'mssql':
+                snapshot, keys = record._cdc_get_changes()
+                if not keys:
+                    continue
+                cnx = None
+                try:
+                    cnx = record.backend_id._get_mssql_connection()
+                    cursor = cnx.cursor()
+                    record._mssql_delete_keys(cursor, keys)
+                    record._mssql_insert_into_table(cursor, keys=keys)
+                    cnx.commit()
+                    record.log = f'{len(keys)} changed records applied successfully !' + record._get_rejected_log()
+                    record.state = 'succeed'
+                    record.cdc_snapshot = snapshot
+                except Exception as error:
+                    errors = f'Changes apply failed !!\n\nErrors:\n{error}'
+                    record.log = errors
+                    record.state = 'failed'
+                finally:
+                    if cnx is not None:
+                        cnx.close()
+        return res
+
+    def _mssql_delete_keys(self, cursor, keys):
+        self.ensure_one()
+        key_name = self._get_key_field().dwh_name
+        for i in range(0, len(keys), 1000):
+            chunk = keys[i:i + 1000]
+            placeholders = ', '.join(['%s' for key in chunk])
+            cursor.execute(f"DELETE FROM {self.table} WHERE {key_name} IN ({placeholders});", tuple(chunk))
+
     def _mssql_drop_table(self, cursor):
         self.ensure_one()
         query = f"DROP TABLE IF EXISTS {self.table};"
@@ -113,35 +162,198 @@ class SmartanalyticsExtractorExtract(models.Model):
 
     def _mssql_get_table_fields(self):
         self.ensure_one()
-        type_mapping = {
-            'NUMERIC': 'NUMERIC',
-            'BOOL': 'BOOL',
-            'STRING': 'STRING',
-        }
         fields = []
-        for field in self.field_ids:
-            field_type = type_mapping.get(field.dwh_type, field.dwh_type)
-            field_required = 'NOT NULL' if field.dwh_required else ''
-            declaration = f"{field.dwh_name} {field_type} {field_required}"
-            fields.append(declaration)
+        for field in self._get_enabled_fields():
+            fields.append(self._mssql_get_field_declaration(field))
         return fields
 
-    def _mssql_insert_into_table(self, cursor):
+    def _mssql_get_field_declaration(self, field, nullable=False):
+        self.ensure_one()
+        type_mapping = {
+            'NUMERIC': 'NUMERIC(38, 10)',
+            'BOOL': 'BIT',
+            'STRING': 'NVARCHAR(MAX)',
+            'DATETIME': 'DATETIME2',
+        }
+        field_type = type_mapping.get(field.dwh_type, field.dwh_type)
+        field_required = 'NOT NULL' if field.dwh_required and not nullable else 'NULL'
+        return f"{field.dwh_name} {field_type} {field_required}"
+
+    def _dwh_sync_schema(self):
         self.ensure_one()
+        if self.type != 'mssql':
+            return super()._dwh_sync_schema()
+        cnx = self.backend_id._get_mssql_connection()
+        try:
+            cursor = cnx.cursor()
+            added_fields = self._mssql_alter_table(cursor)
+            if added_fields and self._can_backfill():
+                self._mssql_backfill(cursor, added_fields)
+            elif added_fields:
+                added_fields = None
+            cnx.commit()
+        finally:
+            cnx.close()
+        return added_fields
 
-        column_names = dict([(field.column, field.dwh_name) for field in self.field_ids])
+    def _mssql_alter_table(self, cursor):
+        """ Add the missing columns to the table, as nullable ones, and make nullable the columns which are
+        not required anymore.
+
+        :return: the added fields, or None if the table doesn't exist
+        """
+        self.ensure_one()
+        cursor.execute("""
+            SELECT COLUMN_NAME, IS_NULLABLE, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH, NUMERIC_PRECISION, NUMERIC_SCALE
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_NAME = %s
+        """, (self.table,))
+        live_columns = {row[0].lower(): row for row in cursor.fetchall()}
+        if not live_columns:
+            return None
+        fields = self._get_enabled_fields()
+        added_fields = fields.browse()
+        for field in fields:
+            live_column = live_columns.pop(field.dwh_name.lower(), None)
+            if live_column is None:
+                declaration = self._mssql_get_field_declaration(field, nullable=True)
+                cursor.execute(f"ALTER TABLE {self.table} ADD {declaration};")
+                added_fields |= field
+            elif live_column[1] == 'NO' and not field.dwh_required:
+                declaration = self._mssql_get_field_declaration(field)
+                cursor.execute(f"ALTER TABLE {self.table} ALTER COLUMN {declaration};")
+        for name, is_nullable, data_type, length, precision, scale in live_columns.values():
+            # The columns which are not extracted anymore are left empty by the inserts
+            if is_nullable == 'NO':
+                column_type = _mssql_column_type(data_type, length, precision, scale)
+                cursor.execute(f"ALTER TABLE {self.table} ALTER COLUMN {name} {column_type} NULL;")
+        return added_fields
+
+    def _mssql_backfill(self, cursor, added_fields):
+        """ Fill the added columns of the rows of the table, from the query, by key column. """
+        self.ensure_one()
+        key_field = self._get_key_field()
+        backfill_fields = key_field | added_fields
+        declarations = ', '.join(self._mssql_get_field_declaration(field, nullable=True) for field in backfill_fields)
+        backfill_table = '#smartanalytics_backfill'
+        cursor.execute(f"CREATE TABLE {backfill_table} ({declarations});")
+        try:
+            if key_field.dwh_type != 'STRING':
+                cursor.execute(f"CREATE INDEX smartanalytics_backfill_key ON {backfill_table} ({key_field.dwh_name});")
+            self._mssql_insert_into_table(cursor, columns=backfill_fields.mapped('column'), table=backfill_table)
+            assignments = ', '.join(f"{field.dwh_name} = backfill.{field.dwh_name}" for field in added_fields)
+            cursor.execute(f"""
+                UPDATE target SET {assignments}
+                FROM {self.table} AS target
+                JOIN {backfill_table} AS backfill ON backfill.{key_field.dwh_name} = target.{key_field.dwh_name};
+            """)
+        finally:
+            cursor.execute(f"DROP TABLE IF EXISTS {backfill_table};")
+
+    def _mssql_get_column_positions(self, cursor):
+        """ Return the position of the columns of the table, by lowercase name. """
+        self.ensure_one()
+        cursor.execute("""
+            SELECT COLUMN_NAME, ORDINAL_POSITION
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_NAME = %s
+        """, (self.table,))
+        return {name.lower(): position for name, position in cursor.fetchall()}
+
+    def _mssql_get_row_converter(self, columns):
+        """ Return a function converting a row of the query to the python types bound by pymssql
+        to the SQL Server type of each column. """
+        self.ensure_one()
+        type_converters = {
+            'INT': int,
+            'FLOAT': float,
+            'STRING': str,
+            'DATE': lambda value: value.date() if isinstance(value, datetime.datetime) else value,
+            'TIME': lambda value: value.time() if isinstance(value, datetime.datetime) else value,
+            'DATETIME': _mssql_datetime,
+        }
         column_types = dict([(field.column, field.dwh_type) for field in self.field_ids])
-        columns = self._get_columns_from_query()
-        fields = ', '.join([column_names[column] for column in columns])
-        placeholders = ', '.join(['%s' for f in columns])
-        query = f"INSERT INTO {self.table} ({fields}) VALUES ({placeholders});"
-        print(query)
-
-        self.env.cr.execute(self.query)
-
-        for row in self.env.cr.fetchall():
-            print(row)
-            for i, column in enumerate(columns):
-                value = row[i]
-                print(value)
-            cursor.execute(query, value)
+        converters = []
+        for column in columns:
+            dwh_type = column_types[column]
+            if dwh_type == 'BOOL':
+                converters.append(lambda value: 1 if value else 0)
+            elif dwh_type in type_converters:
+                converters.append(_mssql_nullable(type_converters[dwh_type]))
+            else:
+                converters.append(lambda value: None if value is False else value)
+
+        def convert_row(row):
+            return tuple(convert(value) for convert, value in zip(converters, row))
+        return convert_row
+
+    def _mssql_insert_into_table(self, cursor, keys=None, columns=None, table=None):
+        self.ensure_one()
+
+        column_names = dict([(field.column, field.dwh_name) for field in self.field_ids])
+        columns = columns or self._get_extract_columns()
+        convert_row = self._mssql_get_row_converter(columns)
+        batch_size = max(self.backend_id.mssql_batch_size, 1)
+        # The bulk copy only fills the table of the extract
+        bulk = self.backend_id.mssql_insert_mode == 'bulk' and not table
+        table = table or self.table
+        if bulk:
+            # The bulk copy addresses the columns by their position in the table, which differs from the order
+            # of the fields once the schema was synchronized
+            positions = self._mssql_get_column_positions(cursor)
+            column_ids = [positions[column_names[column].lower()] for column in columns]
+        else:
+            fields = ', '.join([column_names[column] for column in columns])
+            placeholders = '(%s)' % ', '.join(['%s' for f in columns])
+            # SQL Server accepts 1000 rows per VALUES clause, pymssql formats the parameters in the statement
+            rows_per_statement = 1000
+            statements = {}
+
+        quarantine = self._start_quarantine(columns)
+
+        def transform(rows):
+            return [convert_row(row) for row in quarantine.filter(rows)]
+
+        def write(rows):
+            if not rows:
+                # Every row of the chunk was rejected
+                return
+            if bulk:
+                cursor.connection.bulk_copy(table, rows, column_ids=column_ids, batch_size=batch_size)
+                return
+            for i in range(0, len(rows), rows_per_statement):
+                chunk = rows[i:i + rows_per_statement]
+                if len(chunk) not in statements:
+                    statements[len(chunk)] = "INSERT INTO %s (%s) VALUES %s;" % (
+                        table, fields, ', '.join([placeholders] * len(chunk)))
+                cursor.execute(statements[len(chunk)], tuple(value for row in chunk for value in row))
+
+        self._run_pipeline(transform, write, keys=keys, chunk_size=batch_size, columns=columns)
+        # Raised before the commit of the connection, the inserted rows are not committed. A table is only given
+        # by the backfill, whose rejected rows don't replace those of the last load
+        self._end_quarantine(quarantine, store=not table)
+
+
+def _mssql_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time.min)
+    if isinstance(value, str):
+        # ISO strings are accepted by the validation of the rows
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+
+def _mssql_column_type(data_type, length, precision, scale):
+    if length == -1:
+        return f'{data_type}(MAX)'
+    if length:
+        return f'{data_type}({length})'
+    if data_type in ('numeric', 'decimal'):
+        return f'{data_type}({precision}, {scale})'
+    return data_type
+
+
+def _mssql_nullable(convert):
+    return lambda value: None if value is None or value is False else convert(value)
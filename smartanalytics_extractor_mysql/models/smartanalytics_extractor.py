@@ -1,11 +1,19 @@
 import json
 import datetime
 import re
+import threading
 
 import mysql.connector
+import mysql.connector.pooling
 from odoo import api, fields, models, _
 from odoo.exceptions import ValidationError
 
+# Connection pools of the MySQL datawarehouses, shared by the databases of the process
+_mysql_pools = {}
+_mysql_pools_lock = threading.Lock()
+# Rows of a multi-row INSERT: a whole chunk of wide rows would exceed the max_allowed_packet of the server
+_MYSQL_ROWS_PER_STATEMENT = 1000
+
 
 class SmartanalyticsExtractorBackend(models.Model):
     _inherit = 'smartanalytics.extractor.backend'
@@ -57,10 +65,33 @@ class SmartanalyticsExtractorBackend(models.Model):
 
     def _get_mysql_connection(self):
         self.ensure_one()
+        pool_size = self.env.context.get('smartanalytics_connection_pool_size')
+        if pool_size:
+            # Closing a pooled connection gives it back to the pool
+            return self._get_mysql_pool(pool_size).get_connection()
         cnx = mysql.connector.connect(host=self.mysql_host, port=self.mysql_port, user=self.mysql_user, password=self.mysql_password,
                                       database=self.mysql_database)
         return cnx
 
+    def _get_mysql_pool(self, pool_size):
+        self.ensure_one()
+        key = self._get_target_key() + (self.mysql_password,)
+        with _mysql_pools_lock:
+            if key not in _mysql_pools:
+                _mysql_pools[key] = mysql.connector.pooling.MySQLConnectionPool(
+                    pool_name=f'smartanalytics_{len(_mysql_pools)}',
+                    pool_size=min(pool_size, mysql.connector.pooling.CNX_POOL_MAXSIZE),
+                    host=self.mysql_host, port=self.mysql_port, user=self.mysql_user, password=self.mysql_password,
+                    database=self.mysql_database,
+                )
+            return _mysql_pools[key]
+
+    def _get_target_key(self):
+        self.ensure_one()
+        if self.type == 'mysql':
+            return ('mysql', self.mysql_host, self.mysql_port, self.mysql_database, self.mysql_user)
+        return super()._get_target_key()
+
     def _get_eval_context(self):
         eval_context = super()._get_eval_context()
         eval_context.update({
@@ -80,6 +111,7 @@ class SmartanalyticsExtractorExtract(models.Model):
         res = super().action_run_import()
         for record in self:
             if record.type == 'mysql':
+                cnx = None
                 try:
                     cnx = record.backend_id._get_mysql_connection()
                     cursor = cnx.cursor()
@@ -87,17 +119,53 @@ class SmartanalyticsExtractorExtract(models.Model):
                     record._mysql_create_table(cursor)
                     record._mysql_insert_into_table(cursor)
                     cnx.commit()
-                    record.log = 'Import finished successfully !'
-                    record.state = 'succeed'
+                    record.write(record._get_import_succeed_vals(
+                        'Import finished successfully !' + record._get_rejected_log()))
                 except Exception as error:
                     errors = f'Import failed !!\n\nErrors:\n{error}'
                     record.log = errors
                     record.state = 'failed'
-                else:
-                    cursor.close()
-                    cnx.close()
+                finally:
+                    # A pooled connection must go back to its pool, even after a failure
+                    if cnx is not None:
+                        cnx.close()
         return res
 
+    def action_apply_changes(self):
+        res = super().action_apply_changes()
+        for record in self:
+            if record.type == 'mysql':
+                snapshot, keys = record._cdc_get_changes()
+                if not keys:
+                    continue
+                cnx = None
+                try:
+                    cnx = record.backend_id._get_mysql_connection()
+                    cursor = cnx.cursor()
+                    record._mysql_delete_keys(cursor, keys)
+                    record._mysql_insert_into_table(cursor, keys=keys)
+                    cnx.commit()
+                    record.log = f'{len(keys)} changed records applied successfully !' + record._get_rejected_log()
+                    record.state = 'succeed'
+                    record.cdc_snapshot = snapshot
+                except Exception as error:
+                    errors = f'Changes apply failed !!\n\nErrors:\n{error}'
+                    record.log = errors
+                    record.state = 'failed'
+                finally:
+                    # A pooled connection must go back to its pool, even after a failure
+                    if cnx is not None:
+                        cnx.close()
+        return res
+
+    def _mysql_delete_keys(self, cursor, keys):
+        self.ensure_one()
+        key_name = self._get_key_field().dwh_name
+        for i in range(0, len(keys), 1000):
+            chunk = keys[i:i + 1000]
+            placeholders = ', '.join(['%s' for key in chunk])
+            cursor.execute(f"DELETE FROM {self.table} WHERE {key_name} IN ({placeholders})", chunk)
+
     def _mysql_drop_table(self, cursor):
         self.ensure_one()
         query = f"DROP TABLE IF EXISTS {self.table}"
@@ -110,45 +178,139 @@ class SmartanalyticsExtractorExtract(models.Model):
         cursor.execute(query)
 
     def _mysql_get_table_fields(self):
+        self.ensure_one()
+        fields = []
+        for field in self._get_enabled_fields():
+            fields.append(self._mysql_get_field_declaration(field))
+        return fields
+
+    def _mysql_get_field_declaration(self, field, nullable=False):
         self.ensure_one()
         type_mapping = {
             'NUMERIC': 'INT',
             'BOOL': 'TINYINT',
             'STRING': 'TEXT',
         }
-        fields = []
-        for field in self.field_ids:
-            field_type = type_mapping.get(field.dwh_type, field.dwh_type)
-            field_required = 'NOT NULL' if field.dwh_required else ''
-            declaration = f"{field.dwh_name} {field_type} {field_required}"
-            fields.append(declaration)
-        return fields
+        field_type = type_mapping.get(field.dwh_type, field.dwh_type)
+        field_required = 'NOT NULL' if field.dwh_required and not nullable else ''
+        return f"{field.dwh_name} {field_type} {field_required}"
 
-    def _mysql_insert_into_table(self, cursor):
+    def _dwh_sync_schema(self):
         self.ensure_one()
+        if self.type != 'mysql':
+            return super()._dwh_sync_schema()
+        cnx = self.backend_id._get_mysql_connection()
+        try:
+            cursor = cnx.cursor()
+            added_fields = self._mysql_alter_table(cursor)
+            if added_fields and self._can_backfill():
+                self._mysql_backfill(cursor, added_fields)
+            elif added_fields:
+                added_fields = None
+            cnx.commit()
+        finally:
+            cnx.close()
+        return added_fields
 
-        column_names = dict([(field.column, field.dwh_name) for field in self.field_ids])
+    def _mysql_alter_table(self, cursor):
+        """ Add the missing columns to the table, as nullable ones, and make nullable the columns which are
+        not required anymore.
+
+        :return: the added fields, or None if the table doesn't exist
+        """
+        self.ensure_one()
+        cursor.execute("""
+            SELECT column_name, column_type, is_nullable
+            FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s
+        """, (self.table,))
+        live_columns = {name.lower(): (column_type, is_nullable == 'YES')
+                        for name, column_type, is_nullable in cursor.fetchall()}
+        if not live_columns:
+            return None
+        fields = self._get_enabled_fields()
+        added_fields = fields.browse()
+        for field in fields:
+            live_column = live_columns.pop(field.dwh_name.lower(), None)
+            if live_column is None:
+                declaration = self._mysql_get_field_declaration(field, nullable=True)
+                cursor.execute(f"ALTER TABLE {self.table} ADD COLUMN {declaration}")
+                added_fields |= field
+            elif not live_column[1] and not field.dwh_required:
+                declaration = self._mysql_get_field_declaration(field)
+                cursor.execute(f"ALTER TABLE {self.table} MODIFY COLUMN {declaration}")
+        for name, (column_type, nullable) in live_columns.items():
+            # The columns which are not extracted anymore are left empty by the inserts
+            if not nullable:
+                cursor.execute(f"ALTER TABLE {self.table} MODIFY COLUMN {name} {column_type} NULL")
+        return added_fields
+
+    def _mysql_backfill(self, cursor, added_fields):
+        """ Fill the added columns of the rows of the table, from the query, by key column. """
+        self.ensure_one()
+        key_field = self._get_key_field()
+        backfill_fields = key_field | added_fields
+        declarations = [self._mysql_get_field_declaration(field, nullable=True) for field in backfill_fields]
+        if key_field.dwh_type != 'STRING':
+            declarations.append(f"INDEX ({key_field.dwh_name})")
+        backfill_table = 'smartanalytics_backfill'
+        cursor.execute(f"CREATE TEMPORARY TABLE {backfill_table} ({', '.join(declarations)})")
+        try:
+            self._mysql_insert_into_table(cursor, columns=backfill_fields.mapped('column'), table=backfill_table)
+            assignments = ', '.join(f"{self.table}.{field.dwh_name} = backfill.{field.dwh_name}"
+                                    for field in added_fields)
+            cursor.execute(f"""
+                UPDATE {self.table}
+                JOIN {backfill_table} AS backfill ON backfill.{key_field.dwh_name} = {self.table}.{key_field.dwh_name}
+                SET {assignments}
+            """)
+        finally:
+            cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {backfill_table}")
+
+    def _mysql_get_row_converter(self, columns):
+        """ Return a function converting a row of the query to the values to insert in MySQL. """
+        self.ensure_one()
+        type_converters = {
+            'BOOL': lambda value: 1 if value else 0,
+            'DATE': lambda value: value.strftime('%Y-%m-%d')
+            if isinstance(value, (datetime.date, datetime.datetime)) else _mysql_none(value),
+            'TIME': lambda value: value.strftime('%H:%M:%S')
+            if isinstance(value, (datetime.date, datetime.datetime)) else _mysql_none(value),
+            'DATETIME': lambda value: value.strftime('%Y-%m-%d  %H:%M:%S')
+            if isinstance(value, (datetime.date, datetime.datetime)) else _mysql_none(value),
+        }
         column_types = dict([(field.column, field.dwh_type) for field in self.field_ids])
-        columns = self._get_columns_from_query()
+        converters = [type_converters.get(column_types.get(column), _mysql_none) for column in columns]
+
+        def convert_row(row):
+            return tuple(convert(value) for convert, value in zip(converters, row))
+        return convert_row
+
+    def _mysql_insert_into_table(self, cursor, keys=None, columns=None, table=None):
+        self.ensure_one()
+
+        column_names = dict([(field.column, field.dwh_name) for field in self.field_ids])
+        columns = columns or self._get_extract_columns()
         fields = ', '.join([column_names[column] for column in columns])
         placeholders = ', '.join(['%s' for f in columns])
-        query = f"INSERT INTO {self.table} ({fields}) VALUES ({placeholders})"
-
-        self.env.cr.execute(self.query)
-        for row in self.env.cr.fetchall():
-            values = []
-            for i, column in enumerate(columns):
-                value = row[i]
-                if column_types.get(column) == 'BOOL':
-                    values.append(1 if value else 0)
-                elif column_types.get(column) == 'DATE' and isinstance(value, (datetime.date, datetime.datetime)):
-                    values.append(value.strftime('%Y-%m-%d'))
-                elif column_types.get(column) == 'TIME' and isinstance(value, (datetime.date, datetime.datetime)):
-                    values.append(value.strftime('%H:%M:%S'))
-                elif column_types.get(column) == 'DATETIME' and isinstance(value, (datetime.date, datetime.datetime)):
-                    values.append(value.strftime('%Y-%m-%d  %H:%M:%S'))
-                elif value is False:
-                    values.append(None)
-                else:
-                    values.append(value)
-            cursor.execute(query, values)
+        query = f"INSERT INTO {table or self.table} ({fields}) VALUES ({placeholders})"
+        convert_row = self._mysql_get_row_converter(columns)
+
+        quarantine = self._start_quarantine(columns)
+
+        def transform(rows):
+            return [convert_row(row) for row in quarantine.filter(rows)]
+
+        def write(rows):
+            # The connector sends the rows of an INSERT executemany as a single multi-row statement
+            for i in range(0, len(rows), _MYSQL_ROWS_PER_STATEMENT):
+                cursor.executemany(query, rows[i:i + _MYSQL_ROWS_PER_STATEMENT])
+
+        self._run_pipeline(transform, write, keys=keys, columns=columns)
+        # Raised before the commit of the connection, the inserted rows are not committed. A table is only given
+        # by the backfill, whose rejected rows don't replace those of the last load
+        self._end_quarantine(quarantine, store=not table)
+
+
+def _mysql_none(value):
+    return None if value is False else value